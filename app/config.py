@@ -15,20 +15,97 @@ OPENAI_API_BASE: str = os.environ.get("OPENAI_API_BASE", "https://api.polza.ai/a
 OPENAI_MODEL: str = os.environ.get("OPENAI_MODEL", "google/gemini-3-flash-preview")
 OPENAI_EMBEDDING_MODEL: str = os.environ.get("OPENAI_EMBEDDING_MODEL", "openai/text-embedding-3-large")
 
+# Embedding provider: openai (remote API) | local (sentence-transformers on CPU) | onnx (ONNX / quantized ONNX)
+EMBEDDING_PROVIDER: str = os.environ.get("EMBEDDING_PROVIDER", "openai").strip().lower()
+LOCAL_EMBEDDING_MODEL: str = os.environ.get(
+    "LOCAL_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+)
+EMBEDDING_ONNX_FILE: str = os.environ.get("EMBEDDING_ONNX_FILE", "")  # e.g. onnx/model_qint8_avx512_vnni.onnx
+EMBEDDING_THREADS: int = int(os.environ.get("EMBEDDING_THREADS", "0"))  # CPU threads for local inference; 0 = library default
+EMBEDDING_LOCAL_BATCH_SIZE: int = int(os.environ.get("EMBEDDING_LOCAL_BATCH_SIZE", "32"))
+# HTTP clients (shared, keep-alive pooled): timeouts in seconds, retries use exponential backoff
+LLM_TIMEOUT: float = float(os.environ.get("LLM_TIMEOUT", "60"))
+LLM_CONNECT_TIMEOUT: float = float(os.environ.get("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES: int = int(os.environ.get("LLM_MAX_RETRIES", "3"))
+HTTP_MAX_CONNECTIONS: int = int(os.environ.get("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS: int = int(os.environ.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY: float = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60"))
+
 # Knowledge base (default: kb folder in project root)
 _default_kb = Path(__file__).resolve().parent.parent.parent / "kb"
 KNOWLEDGE_BASE_PATH: Path = Path(os.environ.get("KNOWLEDGE_BASE_PATH", str(_default_kb)))
 INDEX_PATH: Path = Path(os.environ.get("INDEX_PATH", "data/index"))
+# Builds go to INDEX_PATH/generations/<name>/, INDEX_PATH/current points at the served one
+INDEX_KEEP_GENERATIONS: int = int(os.environ.get("INDEX_KEEP_GENERATIONS", "2"))  # older ones are deleted
+INDEX_RELOAD_INTERVAL: float = float(os.environ.get("INDEX_RELOAD_INTERVAL", "5"))  # seconds between pointer checks; 0 = off
 
 # RAG
 TOP_K: int = int(os.environ.get("TOP_K", "5"))
 CHUNK_SIZE: int = int(os.environ.get("CHUNK_SIZE", "1200"))
 CHUNK_OVERLAP: int = int(os.environ.get("CHUNK_OVERLAP", "300"))
+# Token budget of the context block in the answer prompt (tiktoken); 0 = no limit
+CONTEXT_MAX_TOKENS: int = int(os.environ.get("CONTEXT_MAX_TOKENS", "6000"))
 # Минимальный score релевантности (cosine similarity); чанки ниже отфильтровываются. 0 = не фильтровать.
 MIN_RELEVANCE_SCORE: float = float(os.environ.get("MIN_RELEVANCE_SCORE", "0.45"))
 
-# Rate limit (requests per minute per chat)
+# Index type (set at build time): flat (exact) | hnsw | ivf_flat | ivf_pq | opq_ivf_pq
+INDEX_TYPE: str = os.environ.get("INDEX_TYPE", "flat").lower()
+INDEX_NLIST: int = int(os.environ.get("INDEX_NLIST", "1024"))  # IVF lists (capped by corpus size)
+INDEX_HNSW_M: int = int(os.environ.get("INDEX_HNSW_M", "32"))  # HNSW graph degree
+INDEX_EF_CONSTRUCTION: int = int(os.environ.get("INDEX_EF_CONSTRUCTION", "200"))
+INDEX_PQ_M: int = int(os.environ.get("INDEX_PQ_M", "64"))  # PQ sub-quantizers (adjusted to divide the dimension)
+INDEX_TRAIN_SAMPLE: int = int(os.environ.get("INDEX_TRAIN_SAMPLE", "100000"))  # vectors used to train IVF/PQ
+INDEX_RECALL_QUERIES: int = int(os.environ.get("INDEX_RECALL_QUERIES", "200"))  # recall@k report vs flat; 0 = skip
+# Memory-map index.faiss instead of reading it into RAM (pages shared between processes)
+FAISS_MMAP: bool = os.environ.get("FAISS_MMAP", "true").lower() in ("true", "1", "yes")
+# Query-time knobs for approximate indexes
+FAISS_NPROBE: int = int(os.environ.get("FAISS_NPROBE", "16"))  # IVF lists scanned per query
+FAISS_EF_SEARCH: int = int(os.environ.get("FAISS_EF_SEARCH", "128"))  # HNSW search breadth
+
+# Index build: embedding requests
+EMBEDDING_BATCH_SIZE: int = int(os.environ.get("EMBEDDING_BATCH_SIZE", "100"))  # texts per request
+EMBEDDING_BATCH_MAX_TOKENS: int = int(os.environ.get("EMBEDDING_BATCH_MAX_TOKENS", "100000"))  # tokens per request
+EMBEDDING_CONCURRENCY: int = int(os.environ.get("EMBEDDING_CONCURRENCY", "4"))  # requests in flight
+EMBEDDING_MAX_RETRIES: int = int(os.environ.get("EMBEDDING_MAX_RETRIES", "6"))  # on 429 / 5xx / network errors
+EMBEDDING_RETRY_BASE_DELAY: float = float(os.environ.get("EMBEDDING_RETRY_BASE_DELAY", "1.0"))  # seconds, doubles
+EMBEDDING_RETRY_MAX_DELAY: float = float(os.environ.get("EMBEDDING_RETRY_MAX_DELAY", "60"))
+
+# Index build: read / clean / chunk in worker processes (0 = one per CPU, 1 = in-process)
+INGEST_WORKERS: int = int(os.environ.get("INGEST_WORKERS", "0"))
+INGEST_QUEUE_SIZE: int = int(os.environ.get("INGEST_QUEUE_SIZE", "16"))  # embedding batches queued or in flight
+
+# Query-embedding cache: LRU size (0 = off) and optional SQLite file for a persistent tier
+EMBEDDING_CACHE_SIZE: int = int(os.environ.get("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH: str = os.environ.get("EMBEDDING_CACHE_PATH", "")
+# Max rows in the SQLite tier (least recently used are pruned); 0 = unbounded
+EMBEDDING_CACHE_DISK_SIZE: int = int(os.environ.get("EMBEDDING_CACHE_DISK_SIZE", "100000"))
+
+# Async pipeline: threads for blocking steps (FAISS, BM25, cross-encoder) run from the event loop
+RAG_EXECUTOR_WORKERS: int = int(os.environ.get("RAG_EXECUTOR_WORKERS", "4"))
+
+# Streaming answers: placeholder message edited with the answer as tokens arrive
+STREAMING_ENABLED: bool = os.environ.get("STREAMING_ENABLED", "true").lower() in ("true", "1", "yes")
+STREAM_EDIT_INTERVAL: float = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.0"))  # seconds between edits
+
+# Bot scheduler: global concurrency per pipeline stage (0 = unlimited) and request backlog limits
+STAGE_LIMIT_EMBED: int = int(os.environ.get("STAGE_LIMIT_EMBED", "8"))
+STAGE_LIMIT_RETRIEVE: int = int(os.environ.get("STAGE_LIMIT_RETRIEVE", "4"))
+STAGE_LIMIT_RERANK: int = int(os.environ.get("STAGE_LIMIT_RERANK", "2"))
+STAGE_LIMIT_GENERATE: int = int(os.environ.get("STAGE_LIMIT_GENERATE", "8"))
+SCHEDULER_MAX_PENDING: int = int(os.environ.get("SCHEDULER_MAX_PENDING", "100"))  # queued + running, all chats
+SCHEDULER_MAX_PENDING_PER_CHAT: int = int(os.environ.get("SCHEDULER_MAX_PENDING_PER_CHAT", "3"))
+
+# Metrics: Prometheus-style /metrics on METRICS_HOST:METRICS_PORT next to the bot (0 = off)
+METRICS_PORT: int = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST: str = os.environ.get("METRICS_HOST", "0.0.0.0")
+
+# Rate limit (token bucket; requests per minute per chat, optional per user and global)
 RATE_LIMIT_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))
+RATE_LIMIT_USER_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_USER_PER_MINUTE", "0"))  # 0 = off
+RATE_LIMIT_GLOBAL_PER_MINUTE: int = int(os.environ.get("RATE_LIMIT_GLOBAL_PER_MINUTE", "0"))  # 0 = off
+RATE_LIMIT_IDLE_TTL: float = float(os.environ.get("RATE_LIMIT_IDLE_TTL", "600"))  # seconds until an idle chat is forgotten
+RATE_LIMIT_BACKEND: str = os.environ.get("RATE_LIMIT_BACKEND", "memory").strip().lower()  # memory | redis
+REDIS_URL: str = os.environ.get("REDIS_URL", "")
 
 # Hybrid search (BM25 + vector + RRF)
 HYBRID_SEARCH_ENABLED: bool = os.environ.get("HYBRID_SEARCH_ENABLED", "false").lower() in ("true", "1", "yes")
@@ -40,10 +117,38 @@ RERANKER_TOP_N: int = int(os.environ.get("RERANKER_TOP_N", "20"))  # candidates
 RERANKER_MODEL: str = os.environ.get("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
 RERANK_API_URL: str = os.environ.get("RERANK_API_URL", "")  # optional: use API instead of local model
 RERANK_API_KEY: str = os.environ.get("RERANK_API_KEY", "")
+RERANKER_BATCH_SIZE: int = int(os.environ.get("RERANKER_BATCH_SIZE", "32"))  # pairs per forward pass
+RERANKER_THREADS: int = int(os.environ.get("RERANKER_THREADS", "0"))  # torch CPU threads; 0 = library default
+# Micro-batching: pairs from concurrent queries arriving within this window go into one predict()
+RERANKER_MICROBATCH_WAIT_MS: float = float(os.environ.get("RERANKER_MICROBATCH_WAIT_MS", "5"))  # 0 = off
+RERANKER_MICROBATCH_MAX_PAIRS: int = int(os.environ.get("RERANKER_MICROBATCH_MAX_PAIRS", "256"))
+# Load the cross-encoder at bot startup instead of on the first query
+RERANKER_WARMUP: bool = os.environ.get("RERANKER_WARMUP", "true").lower() in ("true", "1", "yes")
 
 # Query expansion (multi-query)
 QUERY_EXPANSION_ENABLED: bool = os.environ.get("QUERY_EXPANSION_ENABLED", "false").lower() in ("true", "1", "yes")
 QUERY_EXPANSION_VARIANTS: int = int(os.environ.get("QUERY_EXPANSION_VARIANTS", "3"))  # total variants (incl. original)
 
+# Adaptive retrieval (each knob 0 = off); decisions are logged and counted in rag_adaptive_decisions_total.
+# Start with this many candidates and double while all of them pass MIN_RELEVANCE_SCORE (up to the fixed fetch_k)
+ADAPTIVE_FETCH_K_START: int = int(os.environ.get("ADAPTIVE_FETCH_K_START", "0"))
+# Skip the reranker when the top vector similarity, or its gap to the second hit, reaches the threshold
+RERANK_SKIP_SCORE: float = float(os.environ.get("RERANK_SKIP_SCORE", "0"))
+RERANK_SKIP_GAP: float = float(os.environ.get("RERANK_SKIP_GAP", "0"))
+# Same for query expansion: the original query alone is used when it already retrieves strongly
+EXPANSION_SKIP_SCORE: float = float(os.environ.get("EXPANSION_SKIP_SCORE", "0"))
+EXPANSION_SKIP_GAP: float = float(os.environ.get("EXPANSION_SKIP_GAP", "0"))
+
+# Metadata filters: restrict a chat to source path prefixes and / or frontmatter tags (app/rag/filters.py).
+# JSON {"<chat_id>": {"sources": ["product_a/"], "tags": ["billing"]}, "*": {...}}; empty = whole index for everyone
+CHAT_FILTERS: str = os.environ.get("CHAT_FILTERS", "")
+
+# Semantic answer cache: reuse an answer for a near-identical query over (mostly) the same chunks
+ANSWER_CACHE_ENABLED: bool = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() in ("true", "1", "yes")
+ANSWER_CACHE_MAX_DISTANCE: float = float(os.environ.get("ANSWER_CACHE_MAX_DISTANCE", "0.05"))  # cosine distance
+ANSWER_CACHE_MIN_OVERLAP: float = float(os.environ.get("ANSWER_CACHE_MIN_OVERLAP", "0.6"))  # Jaccard of chunk sets
+ANSWER_CACHE_TTL: float = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))  # seconds; 0 = no expiry
+ANSWER_CACHE_SIZE: int = int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+
 # Optional: override system prompt for LLM (empty = use built-in universal prompt)
 RAG_SYSTEM_PROMPT: str = os.environ.get("RAG_SYSTEM_PROMPT", "")
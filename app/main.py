@@ -1,34 +1,37 @@
 """RAG Telegram bot over custom knowledge base."""
 import asyncio
 import logging
-import time
-from collections import defaultdict
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 
-from app.config import RATE_LIMIT_PER_MINUTE, TELEGRAM_BOT_TOKEN
-from app.rag.llm import generate_answer
+from app.config import (
+    INDEX_RELOAD_INTERVAL,
+    METRICS_HOST,
+    METRICS_PORT,
+    RERANKER_ENABLED,
+    RERANKER_WARMUP,
+    SCHEDULER_MAX_PENDING,
+    SCHEDULER_MAX_PENDING_PER_CHAT,
+    STREAM_EDIT_INTERVAL,
+    STREAMING_ENABLED,
+    TELEGRAM_BOT_TOKEN,
+)
+from app.metrics import count_cache, start_metrics_server, timed
+from app.rag.answer_cache import get_answer_cache
+from app.rag.concurrency import stage_slot
+from app.rag.filters import chat_filter
+from app.rag.llm import agenerate_answer, astream_answer
 from app.rag.retriever import RAGRetriever
+from app.rate_limit import make_rate_limiter
+from app.scheduler import ChatScheduler
 from app.utils.telegram_format import markdown_to_telegram_html
+from app.utils.telegram_stream import StreamingReply
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Rate limit: chat_id -> list of timestamps in last minute
-_rate: defaultdict[int, list[float]] = defaultdict(list)
-
-
-def _check_rate_limit(chat_id: int) -> bool:
-    now = time.monotonic()
-    window = 60.0  # 1 minute
-    _rate[chat_id] = [t for t in _rate[chat_id] if now - t < window]
-    if len(_rate[chat_id]) >= RATE_LIMIT_PER_MINUTE:
-        return False
-    _rate[chat_id].append(now)
-    return True
-
 
 async def cmd_start(message: Message) -> None:
     await message.answer(
@@ -40,22 +43,46 @@ async def cmd_start(message: Message) -> None:
 async def on_text(message: Message, retriever: RAGRetriever) -> None:
     if not message.text or not message.text.strip():
         return
-    chat_id = message.chat.id
-    if not _check_rate_limit(chat_id):
-        await message.answer("Слишком много запросов. Подожди минуту.")
-        return
     query = message.text.strip()
+    with timed("request"):
+        await _answer(message, retriever, query)
+
+
+async def _answer(message: Message, retriever: RAGRetriever, query: str) -> None:
     try:
-        contexts = retriever.search(query)
+        search_filter = chat_filter(message.chat.id)
+        contexts = await retriever.asearch(query, search_filter=search_filter)
         if not contexts:
             await message.answer("По твоему запросу ничего не найдено в базе знаний.")
             return
-        answer = generate_answer(query, contexts)
+        answer_cache = get_answer_cache()
+        answer = None
+        if answer_cache is not None:
+            query_vec = await retriever.aembed_query(query)
+            answer = answer_cache.lookup(query_vec, contexts, retriever.index_version, search_filter)
+            count_cache("answer", int(answer is not None), int(answer is None))
+        if answer is None and STREAMING_ENABLED:
+            # Плейсхолдер сразу, дальше правим его по мере генерации
+            reply = StreamingReply(message, STREAM_EDIT_INTERVAL)
+            await reply.start()
+            # Слот generate берёт сам astream_answer на время ожидания модели
+            async for delta in astream_answer(query, contexts):
+                await reply.push(delta)
+            answer = await reply.finish()
+            if answer_cache is not None:
+                answer_cache.put(query_vec, contexts, answer, retriever.index_version, search_filter)
+            return
+        if answer is None:
+            async with stage_slot("generate"):
+                answer = await agenerate_answer(query, contexts)
+            if answer_cache is not None:
+                answer_cache.put(query_vec, contexts, answer, retriever.index_version, search_filter)
         answer_html = markdown_to_telegram_html(answer)
-        try:
-            await message.answer(answer_html, parse_mode="HTML")
-        except Exception:
-            await message.answer(answer)
+        with timed("telegram_send"):
+            try:
+                await message.answer(answer_html, parse_mode="HTML")
+            except Exception:
+                await message.answer(answer)
     except Exception as e:
         logger.exception("RAG error")
         await message.answer(f"Ошибка при ответе: {e!s}")
@@ -67,18 +94,42 @@ async def main() -> None:
 
     retriever = RAGRetriever()
     retriever.load()
+    if RERANKER_ENABLED and RERANKER_WARMUP:
+        from app.rag.reranker import warmup
+        if warmup():
+            logger.info("Reranker warmed up")
 
     bot = Bot(token=TELEGRAM_BOT_TOKEN)
     dp = Dispatcher()
 
     dp.message.register(cmd_start, CommandStart())
 
+    rate_limiter = make_rate_limiter()
+    scheduler = ChatScheduler(SCHEDULER_MAX_PENDING, SCHEDULER_MAX_PENDING_PER_CHAT)
+
     async def handle_text(message: Message) -> None:
-        await on_text(message, retriever)
+        if not message.text or not message.text.strip():
+            return
+        chat_id = message.chat.id
+        user_id = message.from_user.id if message.from_user else None
+        if not await rate_limiter.allow(chat_id, user_id):
+            await message.answer("Слишком много запросов. Подожди минуту.")
+            return
+        # Сообщения одного чата — по очереди; при переполненной очереди сразу отвечаем, а не висим до таймаута
+        if not scheduler.submit(chat_id, lambda: on_text(message, retriever)):
+            await message.answer("Очередь запросов заполнена. Попробуй чуть позже.")
 
     dp.message.register(handle_text, F.text)
 
-    await dp.start_polling(bot)
+    if METRICS_PORT:
+        await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    # Новая сборка индекса подхватывается без рестарта: retriever следит за указателем current
+    watcher = asyncio.create_task(retriever.watch(INDEX_RELOAD_INTERVAL)) if INDEX_RELOAD_INTERVAL > 0 else None
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if watcher is not None:
+            watcher.cancel()
 
 
 if __name__ == "__main__":
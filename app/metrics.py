@@ -0,0 +1,164 @@
+"""
+Lightweight in-process metrics (per-stage latency histograms, counters) and a Prometheus-style
+/metrics endpoint. An observation is a perf_counter() pair, a bisect and a short lock, so the
+instrumentation stays on in production; no prometheus_client dependency.
+"""
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# Секунды: от FAISS/BM25 (доли мс) до генерации ответа LLM (десятки секунд)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 30, 50, 100, 200)
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000)
+
+_lock = threading.Lock()
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values."""
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...]):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series: dict[tuple[tuple[str, str], ...], list] = {}  # labels -> [counts per bucket + inf, sum]
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            snapshot = [(dict(k), list(v[0]), v[1]) for k, v in self._series.items()]
+        for labels, counts, total in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels({**labels, 'le': repr(float(bound))})} {cumulative}")
+            cumulative += counts[-1]
+            lines.append(f"{self.name}_bucket{_labels({**labels, 'le': '+Inf'})} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple[tuple[str, str], ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            snapshot = list(self._values.items())
+        for key, value in snapshot:
+            lines.append(f"{self.name}{_labels(dict(key))} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Duration of pipeline stages (embed, faiss, bm25, rrf, rerank, llm, search, telegram_send, request).",
+    LATENCY_BUCKETS,
+)
+CANDIDATES = Histogram("rag_candidates", "Number of candidates produced per query by source.", COUNT_BUCKETS)
+CACHE_REQUESTS = Counter("rag_cache_requests_total", "Cache lookups by cache and result (hit/miss).")
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM token usage by kind (input/output).")
+CONTEXT_TOKENS = Histogram("rag_context_tokens", "Tokens of the packed context block per answer prompt.", TOKEN_BUCKETS)
+ADAPTIVE_DECISIONS = Counter(
+    "rag_adaptive_decisions_total",
+    "Adaptive retrieval decisions (rerank_skipped, expansion_skipped, expansion_unused, fetch_k_grown).",
+)
+
+_REGISTRY = (STAGE_SECONDS, CANDIDATES, CACHE_REQUESTS, LLM_TOKENS, CONTEXT_TOKENS, ADAPTIVE_DECISIONS)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record the duration of the block under rag_stage_seconds{stage=...}; works around awaits too."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def observe_candidates(source: str, n: int) -> None:
+    CANDIDATES.observe(n, source=source)
+
+
+def count_cache(cache: str, hits: int, misses: int) -> None:
+    if hits:
+        CACHE_REQUESTS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_REQUESTS.inc(misses, cache=cache, result="miss")
+
+
+def count_tokens(usage: dict | None) -> None:
+    """usage_metadata of a LangChain AIMessage: {input_tokens, output_tokens, ...}."""
+    if not usage:
+        return
+    LLM_TOKENS.inc(usage.get("input_tokens", 0), kind="input")
+    LLM_TOKENS.inc(usage.get("output_tokens", 0), kind="output")
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны — дочитываем до пустой строки
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Serve GET /metrics on host:port in the running event loop (next to dp.start_polling)."""
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("Metrics endpoint on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,158 @@
+"""
+FAISS index types for the knowledge base: exact (flat) or approximate (HNSW, IVF-Flat, IVF-PQ,
+OPQ + IVF-PQ). All indexes use inner product over L2-normalized vectors (cosine similarity)
+and accept stable chunk ids via add_with_ids.
+"""
+from typing import Any
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "opq_ivf_pq")
+
+# FAISS wants ~39 training points per centroid; PQ needs at least 2^8 points per sub-quantizer
+_POINTS_PER_CENTROID = 39
+_PQ_MIN_TRAIN = 256
+# Rows per block of the exact baseline in recall_at_k
+_EXACT_BLOCK = 65536
+# Norm of the random offset added to recall_at_k queries (vectors are unit length)
+_QUERY_NOISE = 0.3
+
+
+def _pq_subquantizers(dim: int, pq_m: int) -> int:
+    """Largest number of PQ sub-quantizers <= pq_m that divides dim."""
+    m = max(1, min(pq_m, dim))
+    while dim % m:
+        m -= 1
+    return m
+
+
+def make_index(
+    index_type: str,
+    train_vectors: np.ndarray,
+    nlist: int,
+    hnsw_m: int,
+    ef_construction: int,
+    pq_m: int,
+    train_sample: int,
+    seed: int = 0,
+) -> Any:
+    """
+    Create (and train, for IVF types) an empty index for vectors like train_vectors.
+    nlist is capped by the training set size; too few vectors for PQ falls back to IVF-Flat.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+    dim = train_vectors.shape[1]
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        hnsw.hnsw.efConstruction = ef_construction
+        return faiss.IndexIDMap2(hnsw)
+
+    if len(train_vectors) > train_sample > 0:
+        rng = np.random.default_rng(seed)
+        train_vectors = train_vectors[rng.choice(len(train_vectors), train_sample, replace=False)]
+    nlist = max(1, min(nlist, len(train_vectors) // _POINTS_PER_CENTROID))
+    if index_type != "ivf_flat" and len(train_vectors) < _PQ_MIN_TRAIN:
+        print(f"Only {len(train_vectors)} training vectors, using ivf_flat instead of {index_type}")
+        index_type = "ivf_flat"
+    m = _pq_subquantizers(dim, pq_m)
+    if index_type == "ivf_flat":
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "ivf_pq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatIP(dim), dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+    else:
+        index = faiss.index_factory(dim, f"OPQ{m},IVF{nlist},PQ{m}", faiss.METRIC_INNER_PRODUCT)
+    index.train(train_vectors)
+    return index
+
+
+def index_kind(index: Any) -> str:
+    """Detect which of INDEX_TYPES a loaded index is."""
+    if isinstance(index, faiss.IndexPreTransform):
+        return "opq_ivf_pq"
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def supports_remove(index: Any) -> bool:
+    """HNSW graphs cannot drop vectors; every other type here can."""
+    return index_kind(index) != "hnsw"
+
+
+def apply_search_params(index: Any, nprobe: int, ef_search: int) -> str:
+    """Set query-time knobs (nprobe for IVF, efSearch for HNSW); returns the detected index kind."""
+    kind = index_kind(index)
+    params = faiss.ParameterSpace()
+    if kind in ("ivf_flat", "ivf_pq", "opq_ivf_pq"):
+        params.set_index_parameter(index, "nprobe", nprobe)
+    elif kind == "hnsw":
+        params.set_index_parameter(index, "efSearch", ef_search)
+    return kind
+
+
+def filtered_search_params(kind: str, nprobe: int, ef_search: int, selector: Any) -> Any:
+    """
+    SearchParameters restricting index.search to the ids accepted by selector (checked during the
+    scan / graph walk, not after it). Per-call parameters replace the index defaults, so nprobe and
+    efSearch are repeated here. The caller keeps selector (and its bitmap) alive.
+    """
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search)
+    if kind == "opq_ivf_pq":
+        return faiss.SearchParametersPreTransform(index_params=faiss.SearchParametersIVF(sel=selector, nprobe=nprobe))
+    if kind in ("ivf_flat", "ivf_pq"):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def recall_at_k(
+    index: Any, vectors: np.ndarray, ids: np.ndarray, k: int, n_queries: int, seed: int = 0
+) -> float:
+    """
+    Recall@k of index against exact inner-product search. Queries are sampled stored vectors with
+    a small random perturbation (closer to real queries than exact copies), and the sampled vector
+    itself is dropped from both the exact and the approximate results, so a query finding its own
+    source does not count as a hit. vectors may be a np.memmap: exact scores are computed block by block.
+    """
+    if len(vectors) < 2:
+        return 1.0
+    k = min(k, len(vectors) - 1)
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False))
+    self_ids = np.asarray(ids)[sample]
+    queries = np.asarray(vectors[sample], dtype=np.float32)
+    queries = queries + rng.normal(0.0, _QUERY_NOISE / np.sqrt(queries.shape[1]), queries.shape).astype(np.float32)
+    queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    # One extra neighbour in both searches makes room for the dropped self-id
+    depth = k + 1
+    best_scores = np.full((len(queries), depth), -np.inf, dtype=np.float32)
+    truth = np.full((len(queries), depth), -1, dtype=np.int64)
+    for start in range(0, len(vectors), _EXACT_BLOCK):
+        scores = np.hstack([best_scores, queries @ np.asarray(vectors[start:start + _EXACT_BLOCK]).T])
+        block_ids = np.broadcast_to(ids[start:start + _EXACT_BLOCK], (len(queries), scores.shape[1] - depth))
+        top = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        truth = np.take_along_axis(np.hstack([truth, block_ids]), top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    truth = np.take_along_axis(truth, order, axis=1)
+    _, found = index.search(queries, depth)
+    hits = 0
+    for t, f, own in zip(truth, found, self_ids):
+        t = t[(t >= 0) & (t != own)][:k]
+        f = f[(f >= 0) & (f != own)][:k]
+        hits += len(set(t) & set(f))
+    return hits / (len(queries) * k)
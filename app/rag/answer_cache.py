@@ -0,0 +1,178 @@
+"""
+Semantic answer cache in front of generate_answer.
+A cached answer is reused when the new query embedding is within ANSWER_CACHE_MAX_DISTANCE
+(cosine distance) of a cached query and the retrieved chunk sets overlap enough. Query vectors
+live in a small FAISS index; entries expire by TTL and the oldest are evicted past the size cap.
+The whole cache is dropped when the knowledge-base index version changes (rebuild).
+Entries only match within the same scope (the chat's search filter), so an answer built from
+one knowledge base is never served to a chat restricted to another.
+"""
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from app.config import (
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_DISTANCE,
+    ANSWER_CACHE_MIN_OVERLAP,
+    ANSWER_CACHE_SIZE,
+    ANSWER_CACHE_TTL,
+)
+
+# How many nearest cached queries to check for a matching chunk set
+_SEARCH_K = 4
+
+
+@dataclass
+class _Entry:
+    answer: str
+    chunk_keys: frozenset[tuple[str, str]]
+    created: float
+    scope: Any = None
+
+
+def _chunk_keys(contexts: list[dict[str, Any]]) -> frozenset[tuple[str, str]]:
+    return frozenset((c.get("source_path") or "", c.get("text") or "") for c in contexts)
+
+
+def _overlap(a: frozenset, b: frozenset) -> float:
+    """Jaccard overlap of two chunk sets."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class AnswerCache:
+    """Answers keyed by normalized query embedding; lookup() also requires overlapping retrieved chunks."""
+
+    def __init__(
+        self,
+        max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+        min_overlap: float = ANSWER_CACHE_MIN_OVERLAP,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_size: int = ANSWER_CACHE_SIZE,
+    ):
+        if faiss is None:
+            raise RuntimeError("faiss-cpu is required for the answer cache. Install: pip install faiss-cpu")
+        self.max_distance = max_distance
+        self.min_overlap = min_overlap
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.hits = 0
+        self.misses = 0
+        self._index: Any = None
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._next_id = 0
+        self._index_version: str | None = None
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _reset(self) -> None:
+        self._index = None
+        self._entries.clear()
+
+    def _check_version(self, index_version: str | None) -> None:
+        if index_version != self._index_version:
+            self._reset()
+            self._index_version = index_version
+
+    def _remove(self, ids: list[int]) -> None:
+        if not ids:
+            return
+        for i in ids:
+            self._entries.pop(i, None)
+        self._index.remove_ids(np.array(ids, dtype=np.int64))
+
+    def _expire(self, now: float) -> None:
+        if self.ttl <= 0:
+            return
+        expired = []
+        for i, e in self._entries.items():  # insertion order = creation order
+            if now - e.created < self.ttl:
+                break
+            expired.append(i)
+        self._remove(expired)
+
+    def lookup(
+        self,
+        query_vec: np.ndarray,
+        contexts: list[dict[str, Any]],
+        index_version: str | None = None,
+        scope: Any = None,
+    ) -> str | None:
+        """Return a cached answer for a near-identical query over the same chunks, else None."""
+        with self._lock:
+            self._check_version(index_version)
+            self._expire(time.monotonic())
+            if self._index is None or not self._entries:
+                self.misses += 1
+                return None
+            qv = np.asarray(query_vec, dtype=np.float32).reshape(1, -1)
+            sims, ids = self._index.search(qv, min(_SEARCH_K, len(self._entries)))
+            keys = _chunk_keys(contexts)
+            for sim, i in zip(sims[0], ids[0]):
+                if i < 0 or 1.0 - float(sim) > self.max_distance:
+                    continue
+                entry = self._entries.get(int(i))
+                if entry is None or entry.scope != scope:
+                    continue
+                if _overlap(keys, entry.chunk_keys) >= self.min_overlap:
+                    self.hits += 1
+                    return entry.answer
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        query_vec: np.ndarray,
+        contexts: list[dict[str, Any]],
+        answer: str,
+        index_version: str | None = None,
+        scope: Any = None,
+    ) -> None:
+        qv = np.asarray(query_vec, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            self._check_version(index_version)
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(qv.shape[1]))
+            overflow = len(self._entries) + 1 - self.max_size
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow])
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(qv, np.array([entry_id], dtype=np.int64))
+            self._entries[entry_id] = _Entry(answer, _chunk_keys(contexts), time.monotonic(), scope)
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+_cache: AnswerCache | None = None
+
+
+def get_answer_cache() -> AnswerCache | None:
+    """Process-wide answer cache; None when ANSWER_CACHE_ENABLED is off."""
+    global _cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = AnswerCache()
+    return _cache
@@ -0,0 +1,361 @@
+"""
+Offline retrieval benchmark: synthetic corpus, deterministic fake embeddings, no network.
+
+Builds an index of N synthetic chunks with the regular on-disk layout (FAISS + chunk store + BM25),
+runs RAGRetriever.search in several modes and reports p50/p95/p99 latency, QPS and recall@k
+against exact inner-product search. Results go to JSON to compare commits.
+
+Run: python -m app.rag.bench --sizes 10000,100000 --out bench.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+from app.config import INDEX_EF_CONSTRUCTION, INDEX_HNSW_M, INDEX_NLIST, INDEX_PQ_M, INDEX_TRAIN_SAMPLE, INDEX_TYPE
+from app.rag import reranker as reranker_module
+from app.rag import retriever as retriever_module
+from app.rag.ann_index import INDEX_TYPES, make_index
+from app.rag.bm25 import BM25Index
+from app.rag.chunk_store import write_chunk_store
+from app.rag.embedding_cache import get_embedding_cache
+from app.rag.embeddings import EmbeddingProvider
+from app.rag.retriever import RAGRetriever
+
+MODES = ("vector", "hybrid", "expansion", "rerank", "batch")
+DEFAULT_MODES = ("vector", "hybrid", "expansion", "rerank")
+_LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def _word(i: int) -> str:
+    out = ""
+    i += 26 * 26  # не короче трёх букв
+    while i:
+        i, r = divmod(i, 26)
+        out += _LETTERS[r]
+    return out
+
+
+class FakeEmbedder(EmbeddingProvider):
+    """
+    Deterministic bag-of-words embedding: each word has a fixed random vector (seeded), a text is
+    the sum of its word vectors. Texts sharing words are close, so ANN/BM25/RRF behave as on real data.
+    """
+
+    name = "bench"
+
+    def __init__(self, vocab_size: int, dim: int, seed: int = 0):
+        super().__init__(f"bow-{vocab_size}x{dim}-{seed}")
+        self.dim = dim
+        self.calls = 0
+        self.words = [_word(i) for i in range(vocab_size)]
+        self._word_ids = {w: i for i, w in enumerate(self.words)}
+        self.word_vectors = np.random.default_rng(seed).standard_normal((vocab_size, dim)).astype(np.float32)
+        self._unknown: dict[str, np.ndarray] = {}
+
+    def _vector(self, word: str) -> np.ndarray:
+        i = self._word_ids.get(word)
+        if i is not None:
+            return self.word_vectors[i]
+        vec = self._unknown.get(word)
+        if vec is None:
+            rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+            vec = self._unknown[word] = rng.standard_normal(self.dim).astype(np.float32)
+        return vec
+
+    @property
+    def dimension(self) -> int | None:
+        return self.dim
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        self.calls += 1
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for w in text.lower().split():
+                out[row] += self._vector(w)
+        return out
+
+    def embed_word_ids(self, word_ids: np.ndarray, block: int = 20000) -> np.ndarray:
+        """Same as embed() for texts generated from word ids, vectorized."""
+        out = np.empty((len(word_ids), self.dim), dtype=np.float32)
+        for i in range(0, len(word_ids), block):
+            out[i : i + block] = self.word_vectors[word_ids[i : i + block]].sum(axis=1)
+        return out
+
+
+def make_corpus(
+    n_chunks: int, embedder: FakeEmbedder, words_per_chunk: int = 24, seed: int = 0
+) -> tuple[list[dict[str, Any]], np.ndarray, np.ndarray]:
+    """
+    Topic-clustered synthetic chunks: ~70% of words come from the chunk's topic, the rest
+    from a Zipf-like global distribution. Returns (chunks, word_ids, normalized vectors).
+    """
+    rng = np.random.default_rng(seed)
+    vocab = len(embedder.words)
+    n_topics = max(20, n_chunks // 500)
+    topic_words = rng.integers(0, vocab, (n_topics, 50))
+    topics = rng.integers(0, n_topics, n_chunks)
+    from_topic = rng.random((n_chunks, words_per_chunk)) < 0.7
+    topical = topic_words[topics[:, None], rng.integers(0, 50, (n_chunks, words_per_chunk))]
+    common = (rng.zipf(1.3, (n_chunks, words_per_chunk)) - 1) % vocab
+    word_ids = np.where(from_topic, topical, common)
+
+    words = np.array(embedder.words, dtype=object)
+    chunks = [
+        {"text": " ".join(words[row]), "source_path": f"topic{t:05d}.md", "chunk_index": i, "id": i}
+        for i, (row, t) in enumerate(zip(word_ids, topics))
+    ]
+    vectors = embedder.embed_word_ids(word_ids)
+    faiss.normalize_L2(vectors)
+    return chunks, word_ids, vectors
+
+
+def make_queries(word_ids: np.ndarray, embedder: FakeEmbedder, n_queries: int, seed: int = 1) -> list[str]:
+    """Queries paraphrase random chunks: a subset of their words plus a couple of random ones."""
+    rng = np.random.default_rng(seed)
+    vocab = len(embedder.words)
+    queries = []
+    for row in rng.choice(len(word_ids), n_queries, replace=n_queries > len(word_ids)):
+        picked = rng.choice(word_ids[row], 6, replace=False)
+        noise = rng.integers(0, vocab, 2)
+        queries.append(" ".join(embedder.words[w] for w in np.concatenate([picked, noise])))
+    return queries
+
+
+def write_bench_index(
+    directory: Path, chunks: list[dict[str, Any]], vectors: np.ndarray, index_type: str
+) -> float:
+    """Write the regular index layout (as index_builder does); returns build seconds."""
+    start = time.perf_counter()
+    index = make_index(
+        index_type,
+        vectors,
+        nlist=INDEX_NLIST,
+        hnsw_m=INDEX_HNSW_M,
+        ef_construction=INDEX_EF_CONSTRUCTION,
+        pq_m=INDEX_PQ_M,
+        train_sample=INDEX_TRAIN_SAMPLE,
+    )
+    index.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+    faiss.write_index(index, str(directory / "index.faiss"))
+    write_chunk_store(directory, chunks)
+    BM25Index.build(c["text"] for c in chunks).save(directory)
+    return time.perf_counter() - start
+
+
+def exact_top_k(vectors: np.ndarray, query_vectors: np.ndarray, k: int) -> list[set[int]]:
+    """Ground truth for recall: brute-force inner product over all chunks."""
+    qv = np.array(query_vectors, dtype=np.float32)
+    faiss.normalize_L2(qv)
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, ids = exact.search(qv, k)
+    return [set(int(i) for i in row if i >= 0) for row in ids]
+
+
+@contextmanager
+def _offline_stages(embedder: FakeEmbedder, real_reranker: bool) -> Iterator[None]:
+    """Deterministic local stand-ins for the LLM query expansion and (unless real_reranker) the cross-encoder."""
+
+    def expand(query: str) -> list[str]:
+        words = query.split()
+        return [query, " ".join(reversed(words)), " ".join(words[: max(1, len(words) // 2)]), " ".join(words[1::2])]
+
+    def rerank(query: str, candidates: list[dict[str, Any]], top_k: int) -> list[dict[str, Any]]:
+        qv = embedder.embed([query])[0]
+        cv = embedder.embed([c["text"] for c in candidates])
+        scores = cv @ qv / (np.linalg.norm(cv, axis=1) * np.linalg.norm(qv) + 1e-9)
+        order = np.argsort(-scores)[:top_k]
+        return [{**candidates[i], "rerank_score": float(scores[i])} for i in order]
+
+    async def aexpand(query: str) -> list[str]:
+        return expand(query)
+
+    async def arerank(query: str, candidates: list[dict[str, Any]], top_k: int) -> list[dict[str, Any]]:
+        return rerank(query, candidates, top_k)
+
+    # Sync and async entry points both, so asearch() never reaches the network either
+    saved = (
+        retriever_module._expand_query,
+        retriever_module._aexpand_query,
+        reranker_module.rerank,
+        reranker_module.arerank,
+    )
+    retriever_module._expand_query, retriever_module._aexpand_query = expand, aexpand
+    if not real_reranker:
+        reranker_module.rerank, reranker_module.arerank = rerank, arerank
+    try:
+        yield
+    finally:
+        (
+            retriever_module._expand_query,
+            retriever_module._aexpand_query,
+            reranker_module.rerank,
+            reranker_module.arerank,
+        ) = saved
+
+
+def _percentile_ms(latencies: list[float], q: float) -> float:
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+
+def run_mode(
+    index_dir: Path,
+    embedder: FakeEmbedder,
+    mode: str,
+    queries: list[str],
+    truth: list[set[int]],
+    text_to_id: dict[str, int],
+    k: int,
+    warmup: int = 5,
+) -> dict[str, Any]:
+    retriever = RAGRetriever(
+        index_path=index_dir,
+        hybrid=mode == "hybrid",
+        query_expansion=mode == "expansion",
+        reranker=mode == "rerank",
+        embedder=embedder,
+    )
+    retriever.load()
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache.clear()
+    for q in queries[:warmup]:
+        retriever.search(q + " warmup", top_k=k, min_score=0.0)
+
+    calls_before = embedder.calls
+    latencies: list[float] = []
+    start = time.perf_counter()
+    if mode == "batch":
+        results = retriever.search_batch(queries, top_k=k, min_score=0.0)
+    else:
+        results = []
+        for q in queries:
+            t0 = time.perf_counter()
+            results.append(retriever.search(q, top_k=k, min_score=0.0))
+            latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - start
+
+    hits = 0
+    for found, expected in zip(results, truth):
+        ids = {text_to_id.get(r["text"], -1) for r in found}
+        hits += len(ids & expected)
+    return {
+        "mode": mode,
+        "queries": len(queries),
+        "p50_ms": _percentile_ms(latencies, 50),
+        "p95_ms": _percentile_ms(latencies, 95),
+        "p99_ms": _percentile_ms(latencies, 99),
+        "mean_ms": total / len(queries) * 1000,
+        "qps": len(queries) / total if total > 0 else 0.0,
+        f"recall_at_{k}": hits / (len(queries) * k),
+        "embedding_calls": embedder.calls - calls_before,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def run_benchmark(
+    sizes: list[int],
+    modes: list[str],
+    n_queries: int,
+    k: int,
+    dim: int,
+    vocab_size: int,
+    index_type: str,
+    real_reranker: bool = False,
+    workdir: Path | None = None,
+) -> dict[str, Any]:
+    if faiss is None:
+        raise RuntimeError("faiss-cpu is required. Install: pip install faiss-cpu")
+    embedder = FakeEmbedder(vocab_size, dim)
+    report: dict[str, Any] = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "faiss": getattr(faiss, "__version__", None),
+        "params": {
+            "sizes": sizes, "modes": modes, "queries": n_queries, "k": k, "dim": dim,
+            "vocab_size": vocab_size, "index_type": index_type, "real_reranker": real_reranker,
+        },
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory(prefix="rag-bench-", dir=workdir) as tmp:
+        for n in sizes:
+            index_dir = Path(tmp) / f"n{n}"
+            index_dir.mkdir()
+            t0 = time.perf_counter()
+            chunks, word_ids, vectors = make_corpus(n, embedder)
+            corpus_seconds = time.perf_counter() - t0
+            build_seconds = write_bench_index(index_dir, chunks, vectors, index_type)
+            queries = make_queries(word_ids, embedder, n_queries)
+            truth = exact_top_k(vectors, embedder.embed(queries), k)
+            text_to_id = {c["text"]: c["id"] for c in chunks}
+            del chunks, word_ids
+            print(f"n={n}: corpus {corpus_seconds:.1f}s, {index_type} index build {build_seconds:.1f}s")
+            with _offline_stages(embedder, real_reranker):
+                for mode in modes:
+                    row = run_mode(index_dir, embedder, mode, queries, truth, text_to_id, k)
+                    row.update(n_chunks=n, index_type=index_type, build_seconds=build_seconds)
+                    report["results"].append(row)
+                    print(
+                        f"  {mode:<10} p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms "
+                        f"p99={row['p99_ms']:.2f}ms qps={row['qps']:.0f} recall@{k}={row[f'recall_at_{k}']:.3f}"
+                    )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark (latency, QPS, recall@k).")
+    parser.add_argument("--sizes", default="10000", help="comma-separated corpus sizes, e.g. 10000,100000,1000000")
+    parser.add_argument("--modes", default=",".join(DEFAULT_MODES), help=f"comma-separated: {', '.join(MODES)}")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--vocab", type=int, default=20000)
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=INDEX_TYPE)
+    parser.add_argument("--real-reranker", action="store_true", help="use the configured reranker instead of the local stand-in")
+    parser.add_argument("--workdir", type=Path, default=None, help="where to build temporary indexes")
+    parser.add_argument("--out", type=Path, default=Path("bench.json"))
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(sorted(unknown))}")
+    report = run_benchmark(
+        sizes=[int(s) for s in args.sizes.split(",")],
+        modes=modes,
+        n_queries=args.queries,
+        k=args.k,
+        dim=args.dim,
+        vocab_size=args.vocab,
+        index_type=args.index_type,
+        real_reranker=args.real_reranker,
+        workdir=args.workdir,
+    )
+    args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Saved {args.out}")
+
+
+if __name__ == "__main__":
+    main()
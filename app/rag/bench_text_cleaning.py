@@ -0,0 +1,148 @@
+"""
+Equivalence check and throughput benchmark for text_cleaning.
+
+The reference below is the previous per-character implementation; clean_text and
+normalize_for_embedding must return exactly the same strings. Random inputs are drawn from an
+alphabet of the tricky cases (every kind of whitespace, \\r\\n pairs, control and format
+characters, combining marks for NFC, surrogates, private-use and unassigned code points);
+with hypothesis installed, its text() strategy is run as well.
+
+Run: python -m app.rag.bench_text_cleaning [--cases 20000] [--mb 20]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+from unicodedata import normalize as u_normalize
+
+from app.config import KNOWLEDGE_BASE_PATH
+from app.rag.text_cleaning import clean_text, normalize_for_embedding
+
+try:
+    from hypothesis import given, settings
+    from hypothesis import strategies as st
+except ImportError:
+    given = None
+
+
+def reference_clean_text(raw: str) -> str:
+    if not raw or not isinstance(raw, str):
+        return ""
+    text = u_normalize("NFC", raw)
+    text = "".join(
+        c for c in text
+        if c in "\n\t\r" or (c.isprintable() or c.isspace())
+    )
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = text.replace("\t", " ")
+    text = re.sub(r"[^\S\n]+", " ", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def reference_normalize_for_embedding(text: str) -> str:
+    t = reference_clean_text(text)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+_ALPHABET = (
+    list("abcxyz ABC 0129 .,;:!?-_*#`[]()/\\")
+    + list("абвгдеёжзийклмнопрстуфхцчшщъыьэюя")
+    + ["\n", "\r", "\r\n", "\t", "\x0b", "\x0c", "\x1c", "\x1f", "\x85", "\xa0", "\u2028", "\u2029", "\u3000", "\u202f"]
+    + ["\x00", "\x07", "\x1b", "\x7f", "\x9f", "\u200b", "\u200d", "\u2060", "\ufeff", "\xad"]
+    + ["e\u0301", "\u0301", "\u0438\u0306", "\u1100\u1161"]  # combining sequences (NFC)
+    + ["\ud800", "\udfff", "\ue000", "\U000f0000", "\u0378", "\U0001f600", "\U0001f1f7\U0001f1fa"]
+    + ["  ", "\n\n\n", " \n \n ", "\r\r\n", "\n\r\n\r"]
+)
+
+
+def _random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 60)))
+
+
+def _mismatch(text: str) -> str | None:
+    if clean_text(text) != reference_clean_text(text):
+        return "clean_text"
+    if normalize_for_embedding(text) != reference_normalize_for_embedding(text):
+        return "normalize_for_embedding"
+    return None
+
+
+def check_equivalence(cases: int, seed: int = 0) -> bool:
+    rng = random.Random(seed)
+    for i in range(cases):
+        text = _random_text(rng)
+        func = _mismatch(text)
+        if func:
+            print(f"MISMATCH in {func} on case {i}: {text!r}")
+            return False
+    print(f"Random inputs: {cases} cases identical")
+    if given is not None:
+
+        @settings(max_examples=cases, deadline=None)
+        @given(st.text())
+        def prop(text: str) -> None:
+            assert _mismatch(text) is None, text
+
+        prop()
+        print(f"hypothesis text(): {cases} examples identical")
+    else:
+        print("hypothesis is not installed, skipped its text() strategy")
+    return True
+
+
+def _corpus(mb: float) -> str:
+    """Documents from the knowledge base (or ARCHITECTURE.md) repeated up to ~mb megabytes."""
+    files = sorted(Path(KNOWLEDGE_BASE_PATH).rglob("*.md")) if Path(KNOWLEDGE_BASE_PATH).is_dir() else []
+    sample = "\n\n".join(p.read_text(encoding="utf-8", errors="replace") for p in files[:200])
+    if len(sample) < 10_000:
+        sample += Path(__file__).resolve().parents[2].joinpath("ARCHITECTURE.md").read_text(encoding="utf-8")
+    target = int(mb * 1024 * 1024)
+    return (sample * (target // max(1, len(sample.encode("utf-8"))) + 1))[: target // 2]
+
+
+def _throughput(func, text: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return len(text.encode("utf-8")) / best / 1e6
+
+
+def benchmark(mb: float) -> None:
+    text = _corpus(mb)
+    size = len(text.encode("utf-8")) / 1e6
+    print(f"Throughput on {size:.1f} MB (best of 3):")
+    for name, old, new in (
+        ("clean_text", reference_clean_text, clean_text),
+        ("normalize_for_embedding", reference_normalize_for_embedding, normalize_for_embedding),
+    ):
+        old_mb_s, new_mb_s = _throughput(old, text), _throughput(new, text)
+        print(f"  {name:<24} before {old_mb_s:7.1f} MB/s  after {new_mb_s:7.1f} MB/s  x{new_mb_s / old_mb_s:.1f}")
+    queries = [line for line in text.splitlines() if line.strip()][:20000]
+    start = time.perf_counter()
+    for q in queries:
+        reference_normalize_for_embedding(q)
+    before = time.perf_counter() - start
+    start = time.perf_counter()
+    for q in queries:
+        normalize_for_embedding(q)
+    after = time.perf_counter() - start
+    print(f"  short strings ({len(queries)} lines): before {before * 1e6 / len(queries):.1f} us  after {after * 1e6 / len(queries):.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check text_cleaning against the reference and measure throughput.")
+    parser.add_argument("--cases", type=int, default=20000)
+    parser.add_argument("--mb", type=float, default=20.0)
+    args = parser.parse_args()
+    if not check_equivalence(args.cases):
+        sys.exit(1)
+    benchmark(args.mb)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+BM25 (Okapi) index stored as a CSR term-document matrix, built at index time.
+Rows are terms, columns are chunks: data holds the length-normalized term-frequency part of
+BM25, idf holds per-term weights (same formulas and defaults as rank_bm25.BM25Okapi).
+The arrays are saved next to index.faiss and memory-mapped by the retriever; a query only
+touches the postings of its own terms.
+"""
+import json
+import re
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25  # floor for negative idf, as a fraction of the average idf
+
+VOCAB_FILE = "bm25_vocab.json"
+INDPTR_FILE = "bm25_indptr.npy"
+INDICES_FILE = "bm25_indices.npy"
+DATA_FILE = "bm25_data.npy"
+IDF_FILE = "bm25_idf.npy"
+
+BM25_FILES = (VOCAB_FILE, INDPTR_FILE, INDICES_FILE, DATA_FILE, IDF_FILE)
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Simple word tokenization for BM25 (alphanumeric + underscores)."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def bm25_exists(directory: Path) -> bool:
+    return all((directory / name).is_file() for name in BM25_FILES)
+
+
+class BM25Index:
+    """CSR postings (term -> chunk ids, tf weights) plus idf; scores queries with vectorized numpy."""
+
+    def __init__(
+        self,
+        vocab: dict[str, int],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        data: np.ndarray,
+        idf: np.ndarray,
+        n_docs: int,
+    ):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.idf = idf
+        self.n_docs = n_docs
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = K1, b: float = B, epsilon: float = EPSILON) -> "BM25Index":
+        builder = BM25Builder()
+        for text in texts:
+            builder.add(text)
+        return builder.build(k1, b, epsilon)
+
+    def save(self, directory: Path) -> None:
+        terms = [""] * len(self.vocab)
+        for term, i in self.vocab.items():
+            terms[i] = term
+        (directory / VOCAB_FILE).write_text(
+            json.dumps({"n_docs": self.n_docs, "terms": terms}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        np.save(directory / INDPTR_FILE, self.indptr)
+        np.save(directory / INDICES_FILE, self.indices)
+        np.save(directory / DATA_FILE, self.data)
+        np.save(directory / IDF_FILE, self.idf)
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "BM25Index":
+        mode = "r" if mmap else None
+        meta = json.loads((directory / VOCAB_FILE).read_text(encoding="utf-8"))
+        return cls(
+            {term: i for i, term in enumerate(meta["terms"])},
+            np.load(directory / INDPTR_FILE, mmap_mode=mode),
+            np.load(directory / INDICES_FILE, mmap_mode=mode),
+            np.load(directory / DATA_FILE, mmap_mode=mode),
+            np.load(directory / IDF_FILE, mmap_mode=mode),
+            int(meta["n_docs"]),
+        )
+
+    def score_batch(self, queries: list[str], mask: np.ndarray | None = None) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Per query: (chunk ids, scores) of every chunk containing at least one query term, unsorted.
+        Postings of all queries are accumulated in one pass keyed by (query, chunk).
+        mask (bool per chunk) drops postings of excluded chunks before they are scored.
+        """
+        rows: list[np.ndarray] = []
+        docs: list[np.ndarray] = []
+        weights: list[np.ndarray] = []
+        for qi, query in enumerate(queries):
+            counts = Counter(t for t in tokenize(query) if t in self.vocab)
+            for term, qf in counts.items():
+                i = self.vocab[term]
+                lo, hi = int(self.indptr[i]), int(self.indptr[i + 1])
+                term_docs, term_data = self.indices[lo:hi], self.data[lo:hi]
+                if mask is not None:
+                    keep = mask[term_docs]
+                    term_docs, term_data = term_docs[keep], term_data[keep]
+                rows.append(np.full(len(term_docs), qi, dtype=np.int64))
+                docs.append(term_docs)
+                weights.append(term_data * (float(self.idf[i]) * qf))
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+        if not docs:
+            return [empty for _ in queries]
+        n = max(self.n_docs, 1)
+        keys = np.concatenate(rows) * n + np.concatenate(docs)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights).astype(np.float64))
+        bounds = np.searchsorted(uniq // n, np.arange(len(queries) + 1))
+        return [(uniq[lo:hi] % n, scores[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+    def score(self, query: str, mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """(chunk ids, scores) of every chunk containing at least one query term, unsorted."""
+        return self.score_batch([query], mask)[0]
+
+    def top_k_batch(
+        self, queries: list[str], k: int, mask: np.ndarray | None = None
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Per query: top-k (chunk ids, scores) by BM25, best first; only positive scores."""
+        return [_select_top(ids, scores, k) for ids, scores in self.score_batch(queries, mask)]
+
+    def top_k(self, query: str, k: int, mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k (chunk ids, scores) by BM25, best first; only positive scores."""
+        return self.top_k_batch([query], k, mask)[0]
+
+
+def _select_top(ids: np.ndarray, scores: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    positive = scores > 0
+    ids, scores = ids[positive], scores[positive]
+    if len(scores) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        ids, scores = ids[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+
+class BM25Builder:
+    """
+    Incremental BM25Index.build: add() tokenizes one chunk and appends its postings to compact
+    int arrays, so the index builder never keeps chunk texts around; build() sorts them into CSR.
+    """
+
+    def __init__(self):
+        self.vocab: dict[str, int] = {}
+        self._term_ids = array("q")
+        self._doc_ids = array("q")
+        self._tfs = array("d")
+        self._doc_len = array("d")
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, text: str) -> None:
+        doc = len(self._doc_len)
+        tokens = tokenize(text)
+        self._doc_len.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            self._term_ids.append(self.vocab.setdefault(term, len(self.vocab)))
+            self._doc_ids.append(doc)
+            self._tfs.append(tf)
+
+    def build(self, k1: float = K1, b: float = B, epsilon: float = EPSILON) -> BM25Index:
+        vocab = self.vocab
+        n_docs = len(self._doc_len)
+        lengths = np.frombuffer(self._doc_len, dtype=np.float64)
+        avgdl = lengths.mean() if n_docs and lengths.sum() else 1.0
+
+        t = np.frombuffer(self._term_ids, dtype=np.int64)
+        d = np.frombuffer(self._doc_ids, dtype=np.int64)
+        tf = np.frombuffer(self._tfs, dtype=np.float64)
+        order = np.lexsort((d, t))
+        t, d, tf = t[order], d[order], tf[order]
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(t, minlength=len(vocab)), out=indptr[1:])
+        data = tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[d] / avgdl))
+
+        df = np.diff(indptr).astype(np.float64)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        return BM25Index(
+            vocab,
+            indptr,
+            d.astype(np.int32),
+            data.astype(np.float32),
+            idf.astype(np.float32),
+            n_docs,
+        )
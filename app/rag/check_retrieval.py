@@ -28,9 +28,8 @@ def main() -> None:
         print("Нет запросов.")
         return
 
-    for query in queries:
+    for query, results in zip(queries, retriever.search_batch(queries, top_k=TOP_K)):
         print(f"\n{'='*60}\nЗапрос: {query}\n{'='*60}")
-        results = retriever.search(query, top_k=TOP_K)
         if not results:
             print("Ничего не найдено.")
             continue
@@ -0,0 +1,243 @@
+"""
+Compact on-disk chunk metadata, opened with mmap.
+Layout in the index directory:
+  chunks.bin         chunk texts as one contiguous UTF-8 blob
+  chunk_offsets.npy  int64[n + 1] byte offsets of each text in chunks.bin
+  chunk_sources.npy  int32[n] index into sources.json (interned source paths)
+  chunk_index.npy    int32[n] position of the chunk inside its document
+  chunk_ids.npy      int64[n] stable chunk ids (FAISS ids)
+  sources.json       list of source paths
+  source_tags.json   frontmatter tags per entry of sources.json (optional, for metadata filters)
+Every worker process maps the same pages, so startup is near-instant and memory is shared.
+Old indexes with only metadata.json are read from it in memory (the index directory is never written
+at load time); convert them once with `python -m app.rag.index_builder --convert-metadata`.
+"""
+import io
+import json
+import logging
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Any, Iterable, Iterator
+
+import numpy as np
+
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "chunk_offsets.npy"
+SOURCES_FILE = "chunk_sources.npy"
+CHUNK_INDEX_FILE = "chunk_index.npy"
+IDS_FILE = "chunk_ids.npy"
+SOURCE_TABLE_FILE = "sources.json"
+SOURCE_TAGS_FILE = "source_tags.json"
+LEGACY_METADATA_FILE = "metadata.json"
+# Build manifest written by the index builder (file hashes, settings, embedding model)
+MANIFEST_FILE = "manifest.json"
+
+STORE_FILES = (BLOB_FILE, OFFSETS_FILE, SOURCES_FILE, CHUNK_INDEX_FILE, IDS_FILE, SOURCE_TABLE_FILE)
+# Suffix of files being written; they replace the real ones only once complete
+_TMP_SUFFIX = ".tmp"
+
+logger = logging.getLogger(__name__)
+
+
+def store_exists(directory: Path) -> bool:
+    return all((directory / name).is_file() for name in STORE_FILES)
+
+
+class _Packer:
+    """
+    Appends chunks one at a time: the text goes straight to blob (a binary file), the rest into
+    compact typed arrays. Nothing per chunk is kept as Python objects.
+    """
+
+    def __init__(self, blob: Any):
+        self._blob = blob
+        self._source_ids: dict[str, int] = {}
+        self._source_tags: list[list[str]] = []
+        self._offsets = array("q", [0])
+        self._sources = array("i")
+        self._chunk_index = array("i")
+        self._ids = array("q")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, chunk: dict[str, Any]) -> None:
+        data = chunk["text"].encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        source = chunk["source_path"]
+        if source not in self._source_ids:
+            self._source_ids[source] = len(self._source_ids)
+            self._source_tags.append(list(chunk.get("tags") or []))
+        self._sources.append(self._source_ids[source])
+        self._chunk_index.append(int(chunk.get("chunk_index", 0)))
+        self._ids.append(int(chunk.get("id", len(self._ids))))
+
+    def tables(self) -> dict[str, Any]:
+        """Arrays and JSON tables of the store, keyed by file name."""
+        return {
+            OFFSETS_FILE: np.frombuffer(self._offsets, dtype=np.int64),
+            SOURCES_FILE: np.frombuffer(self._sources, dtype=np.int32),
+            CHUNK_INDEX_FILE: np.frombuffer(self._chunk_index, dtype=np.int32),
+            IDS_FILE: np.frombuffer(self._ids, dtype=np.int64),
+            SOURCE_TABLE_FILE: list(self._source_ids),
+            SOURCE_TAGS_FILE: self._source_tags,
+        }
+
+
+class ChunkStoreWriter:
+    """
+    Streaming writer of the binary layout: add() chunks as they are produced, then close().
+    Every file is written under a temporary name and moved into place with os.replace on close,
+    so a reader never sees a half-written store; abort() (or an exception in a with block) removes them.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self._tmp = {name: directory / (name + _TMP_SUFFIX) for name in (*STORE_FILES, SOURCE_TAGS_FILE)}
+        self._blob = open(self._tmp[BLOB_FILE], "wb")
+        self._packer = _Packer(self._blob)
+
+    def __len__(self) -> int:
+        return len(self._packer)
+
+    def add(self, chunk: dict[str, Any]) -> None:
+        """Append one chunk ({text, source_path, chunk_index, id, tags})."""
+        self._packer.add(chunk)
+
+    def close(self) -> int:
+        """Write the tables and publish all files; returns the number of chunks."""
+        self._blob.close()
+        for name, value in self._packer.tables().items():
+            if isinstance(value, np.ndarray):
+                with open(self._tmp[name], "wb") as f:
+                    np.save(f, value)
+            else:
+                self._tmp[name].write_text(json.dumps(value, ensure_ascii=False), encoding="utf-8")
+        for name, path in self._tmp.items():
+            os.replace(path, self.directory / name)
+        return len(self._packer)
+
+    def abort(self) -> None:
+        self._blob.close()
+        for path in self._tmp.values():
+            path.unlink(missing_ok=True)
+
+    def __enter__(self) -> "ChunkStoreWriter":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc: Any) -> None:
+        if exc_type is not None:
+            self.abort()
+
+
+def write_chunk_store(directory: Path, chunks: Iterable[dict[str, Any]]) -> int:
+    """Write chunks ({text, source_path, chunk_index, id, tags}) in the binary layout; returns the count."""
+    with ChunkStoreWriter(directory) as writer:
+        for c in chunks:
+            writer.add(c)
+        return writer.close()
+
+
+def read_json_metadata(directory: Path) -> list[dict[str, Any]]:
+    """Chunks of a legacy metadata.json ({"chunks": [...]})."""
+    return json.loads((directory / LEGACY_METADATA_FILE).read_text(encoding="utf-8"))["chunks"]
+
+
+def convert_json_metadata(directory: Path) -> int:
+    """Convert a legacy metadata.json into the binary store (explicit step, see index_builder --convert-metadata)."""
+    return write_chunk_store(directory, read_json_metadata(directory))
+
+
+class ChunkStore:
+    """Read-only, mmap-backed sequence of chunks; store[i] returns {text, source_path, chunk_index, id, tags}."""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.offsets = np.load(directory / OFFSETS_FILE, mmap_mode="r")
+        self.source_ids = np.load(directory / SOURCES_FILE, mmap_mode="r")
+        self.chunk_index = np.load(directory / CHUNK_INDEX_FILE, mmap_mode="r")
+        self.ids = np.load(directory / IDS_FILE, mmap_mode="r")
+        self.sources: list[str] = json.loads((directory / SOURCE_TABLE_FILE).read_text(encoding="utf-8"))
+        tags_file = directory / SOURCE_TAGS_FILE
+        # Хранилища, собранные до фильтров, без тегов
+        self.source_tags: list[list[str]] = (
+            json.loads(tags_file.read_text(encoding="utf-8")) if tags_file.is_file() else [[] for _ in self.sources]
+        )
+        self._blob: mmap.mmap | bytes = b""
+        with open(directory / BLOB_FILE, "rb") as f:
+            if int(self.offsets[-1]) > 0:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def from_chunks(cls, directory: Path, chunks: Iterable[dict[str, Any]]) -> "ChunkStore":
+        """Same store built in memory (no files written), e.g. from a legacy metadata.json."""
+        blob = io.BytesIO()
+        packer = _Packer(blob)
+        for c in chunks:
+            packer.add(c)
+        packed = packer.tables()
+        store = cls.__new__(cls)
+        store.directory = directory
+        store.offsets = packed[OFFSETS_FILE]
+        store.source_ids = packed[SOURCES_FILE]
+        store.chunk_index = packed[CHUNK_INDEX_FILE]
+        store.ids = packed[IDS_FILE]
+        store.sources = packed[SOURCE_TABLE_FILE]
+        store.source_tags = packed[SOURCE_TAGS_FILE]
+        store._blob = blob.getvalue()
+        return store
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def text(self, i: int) -> str:
+        return self._blob[int(self.offsets[i]) : int(self.offsets[i + 1])].decode("utf-8")
+
+    def source_path(self, i: int) -> str:
+        return self.sources[int(self.source_ids[i])]
+
+    def __getitem__(self, i: int) -> dict[str, Any]:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i = int(i) % len(self)
+        return {
+            "text": self.text(i),
+            "source_path": self.source_path(i),
+            "chunk_index": int(self.chunk_index[i]),
+            "id": int(self.ids[i]),
+            "tags": list(self.source_tags[int(self.source_ids[i])]),
+        }
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def texts(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self.text(i)
+
+
+def open_chunk_store(directory: Path) -> ChunkStore:
+    """
+    Open the binary store. If metadata.json is the only (or newer) metadata, it is read into memory
+    instead: loading never writes to the index directory (shared by workers, possibly read-only).
+    """
+    legacy = directory / LEGACY_METADATA_FILE
+    if store_exists(directory):
+        if not (legacy.is_file() and legacy.stat().st_mtime > (directory / BLOB_FILE).stat().st_mtime):
+            return ChunkStore(directory)
+    elif not legacy.is_file():
+        raise FileNotFoundError(f"Chunk metadata not found in {directory}")
+    logger.warning(
+        "Reading legacy %s into memory; convert it with `python -m app.rag.index_builder --convert-metadata`",
+        legacy,
+    )
+    return ChunkStore.from_chunks(directory, read_json_metadata(directory))
+
+
+def load_chunks(directory: Path) -> list[dict[str, Any]]:
+    """All chunks as a list of dicts (binary store or legacy metadata.json)."""
+    return list(open_chunk_store(directory))
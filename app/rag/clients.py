@@ -0,0 +1,106 @@
+"""
+Shared long-lived API clients: OpenAI (sync/async) and LangChain ChatOpenAI.
+All of them sit on two pooled httpx clients, so warm requests reuse keep-alive connections and
+TLS sessions instead of paying connection setup. Timeouts and retries (exponential backoff,
+honouring Retry-After on 429/5xx) are handled by the OpenAI SDK with the settings from config.
+"""
+import threading
+from functools import lru_cache
+
+import httpx
+from langchain_openai import ChatOpenAI
+from openai import AsyncOpenAI, OpenAI
+
+from app.config import (
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_RETRIES,
+    LLM_TIMEOUT,
+    OPENAI_API_BASE,
+    OPENAI_API_KEY,
+    OPENAI_MODEL,
+)
+
+_lock = threading.Lock()
+_openai_clients: dict[tuple[str, str], OpenAI] = {}
+_async_openai_clients: dict[tuple[str, str], AsyncOpenAI] = {}
+_chat_models: dict[tuple[str, int], ChatOpenAI] = {}
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+@lru_cache(maxsize=1)
+def _http_client() -> httpx.Client:
+    return httpx.Client(timeout=_timeout(), limits=_limits())
+
+
+@lru_cache(maxsize=1)
+def _async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=_timeout(), limits=_limits())
+
+
+def get_openai_client(api_key: str | None = None, base_url: str | None = None) -> OpenAI:
+    """Pooled sync OpenAI client (one per api_key/base_url)."""
+    key = (api_key or OPENAI_API_KEY, base_url or OPENAI_API_BASE)
+    with _lock:
+        client = _openai_clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=_timeout(),
+                max_retries=LLM_MAX_RETRIES,
+                http_client=_http_client(),
+            )
+            _openai_clients[key] = client
+    return client
+
+
+def get_async_openai_client(api_key: str | None = None, base_url: str | None = None) -> AsyncOpenAI:
+    """Pooled AsyncOpenAI client (one per api_key/base_url)."""
+    key = (api_key or OPENAI_API_KEY, base_url or OPENAI_API_BASE)
+    with _lock:
+        client = _async_openai_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=key[0],
+                base_url=key[1],
+                timeout=_timeout(),
+                max_retries=LLM_MAX_RETRIES,
+                http_client=_async_http_client(),
+            )
+            _async_openai_clients[key] = client
+    return client
+
+
+def get_chat_model(max_tokens: int, model: str | None = None) -> ChatOpenAI:
+    """Shared ChatOpenAI for (model, max_tokens); invoke/ainvoke/astream reuse the pooled connections."""
+    key = (model or OPENAI_MODEL, max_tokens)
+    with _lock:
+        llm = _chat_models.get(key)
+        if llm is None:
+            llm = ChatOpenAI(
+                model=key[0],
+                openai_api_key=OPENAI_API_KEY,
+                base_url=OPENAI_API_BASE,
+                max_tokens=max_tokens,
+                timeout=_timeout(),
+                max_retries=LLM_MAX_RETRIES,
+                stream_usage=True,  # usage_metadata in the last streamed chunk (token metrics)
+                http_client=_http_client(),
+                http_async_client=_async_http_client(),
+            )
+            _chat_models[key] = llm
+    return llm
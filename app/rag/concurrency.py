@@ -0,0 +1,63 @@
+"""Bounded executor for blocking RAG steps (FAISS, BM25, cross-encoder) called from async code,
+and global per-stage concurrency limits for the async pipeline."""
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, TypeVar
+
+from app.config import (
+    RAG_EXECUTOR_WORKERS,
+    STAGE_LIMIT_EMBED,
+    STAGE_LIMIT_GENERATE,
+    STAGE_LIMIT_RERANK,
+    STAGE_LIMIT_RETRIEVE,
+)
+
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+
+# Сколько вызовов каждой стадии может идти одновременно во всём процессе (0 = без ограничения)
+STAGE_LIMITS: dict[str, int] = {
+    "embed": STAGE_LIMIT_EMBED,
+    "retrieve": STAGE_LIMIT_RETRIEVE,
+    "rerank": STAGE_LIMIT_RERANK,
+    "generate": STAGE_LIMIT_GENERATE,
+}
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool; size is capped by RAG_EXECUTOR_WORKERS."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max(1, RAG_EXECUTOR_WORKERS),
+            thread_name_prefix="rag-cpu",
+        )
+    return _executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking call in the shared executor so the event loop keeps serving other chats."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+@asynccontextmanager
+async def stage_slot(stage: str) -> AsyncIterator[None]:
+    """
+    Hold one of the global slots of a pipeline stage (embed, retrieve, rerank, generate).
+    A burst across many chats then queues here instead of hitting the embedding API,
+    the LLM API and the CPU reranker all at once.
+    """
+    limit = STAGE_LIMITS[stage]
+    if limit <= 0:
+        yield
+        return
+    sem = _semaphores.get(stage)
+    if sem is None:
+        sem = _semaphores[stage] = asyncio.Semaphore(limit)
+    async with sem:
+        yield
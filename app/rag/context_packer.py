@@ -0,0 +1,89 @@
+"""
+Context packing for the answer prompt: fit retrieved chunks into a token budget.
+Chunks of one document with consecutive chunk_index are merged into one passage and the text
+they share (CHUNK_OVERLAP) is kept once; if the passages still exceed the budget, the
+lowest-scored chunks are dropped first.
+"""
+from typing import Any
+
+from app.rag.tokens import token_counter, truncate_tokens
+
+# Shorter suffix/prefix matches are coincidences, not chunk overlap
+_MIN_OVERLAP = 16
+# "[NN]\n" prefix and the blank line between passages
+_PASSAGE_TOKENS = 4
+
+
+def merge_overlap(left: str, right: str) -> str:
+    """left + right without the longest suffix of left that is also a prefix of right."""
+    head = right[:_MIN_OVERLAP]
+    if len(head) == _MIN_OVERLAP:
+        pos = left.find(head, max(0, len(left) - len(right)))
+        while pos >= 0:
+            if right.startswith(left[pos:]):
+                return left + right[len(left) - pos:]
+            pos = left.find(head, pos + 1)
+    return left + "\n\n" + right
+
+
+def _passages(chunks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Merge runs of consecutive chunk_index per source_path; passages ordered by their best score."""
+    by_source: dict[str, list[dict[str, Any]]] = {}
+    for c in chunks:
+        by_source.setdefault(c.get("source_path") or "?", []).append(c)
+    passages: list[dict[str, Any]] = []
+    for path, items in by_source.items():
+        items.sort(key=lambda c: (c.get("chunk_index") is None, c.get("chunk_index") or 0))
+        last: int | None = None
+        for c in items:
+            idx = c.get("chunk_index")
+            text = (c.get("text") or "").strip()
+            score = c.get("score", 0.0)
+            if passages and last is not None and idx == last + 1 and passages[-1]["source_path"] == path:
+                passages[-1]["text"] = merge_overlap(passages[-1]["text"], text)
+                passages[-1]["score"] = max(passages[-1]["score"], score)
+            else:
+                passages.append({"text": text, "source_path": path, "score": score})
+            last = idx
+    passages.sort(key=lambda p: -p["score"])
+    return passages
+
+
+def pack_contexts(contexts: list[dict[str, Any]], max_tokens: int, model: str) -> tuple[list[dict[str, Any]], int]:
+    """
+    Returns (passages {text, source_path, score}, context tokens). Duplicate chunks are removed;
+    max_tokens <= 0 only merges. A single chunk over the budget is truncated to it.
+    """
+    count = token_counter(model)
+    seen: set[tuple[str, Any]] = set()
+    chunks: list[dict[str, Any]] = []
+    for c in contexts:
+        idx = c.get("chunk_index")
+        key = (c.get("source_path") or "?", idx if idx is not None else c.get("text"))
+        if key not in seen:
+            seen.add(key)
+            chunks.append(c)
+    # Стабильная сортировка: при равных score сохраняется порядок ранжирования
+    chunks.sort(key=lambda c: -c.get("score", 0.0))
+
+    lengths: dict[str, int] = {}
+
+    def size(passages: list[dict[str, Any]]) -> int:
+        total = 0
+        for p in passages:
+            if p["text"] not in lengths:
+                lengths[p["text"]] = count(p["text"])
+            total += lengths[p["text"]] + _PASSAGE_TOKENS
+        return total
+
+    keep = len(chunks)
+    passages = _passages(chunks[:keep])
+    total = size(passages)
+    while max_tokens > 0 and total > max_tokens and keep > 1:
+        keep -= 1
+        passages = _passages(chunks[:keep])
+        total = size(passages)
+    if max_tokens > 0 and total > max_tokens and passages:
+        passages[0]["text"] = truncate_tokens(passages[0]["text"], max(1, max_tokens - _PASSAGE_TOKENS), model)
+        total = count(passages[0]["text"]) + _PASSAGE_TOKENS
+    return passages, total
@@ -0,0 +1,194 @@
+"""
+Query-embedding cache: bounded in-memory LRU with an optional SQLite tier on disk.
+Keys are (embedding model, normalize_for_embedding(text)), so repeated and expanded queries
+skip the embeddings API round-trip.
+The SQLite tier is bounded too (EMBEDDING_CACHE_DISK_SIZE rows, least recently used pruned).
+Writes go through a background thread that commits in batches, so a put() never waits for
+an fsync; async callers read the disk tier through run_blocking (see retriever).
+"""
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+from app.config import EMBEDDING_CACHE_DISK_SIZE, EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_SIZE
+
+# Rows written per transaction by the writer thread
+_WRITE_BATCH = 256
+# Prune the disk tier once it is this much over its cap (amortizes the DELETE)
+_PRUNE_SLACK = 1.1
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of float32 vectors; misses in memory fall through to SQLite when a path is set."""
+
+    def __init__(self, max_size: int, path: Path | None = None, max_disk_rows: int = EMBEDDING_CACHE_DISK_SIZE):
+        self.max_size = max_size
+        self.path = path
+        self.max_disk_rows = max_disk_rows
+        self.hits = 0
+        self.misses = 0
+        self._lru: OrderedDict[tuple[str, str], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+        # (model, text, vector bytes or None = only touch last_used)
+        self._writes: queue.Queue[tuple[str, str, bytes | None]] = queue.Queue()
+        self._writer: threading.Thread | None = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = self._connect()
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, "
+                "last_used REAL NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (model, text))"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(embeddings)")}
+            if "last_used" not in columns:
+                # Кэш, созданный до ограничения размера
+                self._db.execute("ALTER TABLE embeddings ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._db.commit()
+            self._disk_rows = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._writer = threading.Thread(target=self._write_loop, name="embedding-cache-writer", daemon=True)
+            self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(str(self.path), check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @property
+    def has_disk(self) -> bool:
+        return self._db is not None
+
+    def get_memory(self, model: str, text: str) -> np.ndarray | None:
+        """In-memory tier only (never touches the disk); does not count a miss."""
+        key = (model, text)
+        with self._lock:
+            vec = self._lru.get(key)
+            if vec is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+            return vec
+
+    def get_disk(self, model: str, text: str) -> np.ndarray | None:
+        """SQLite tier (blocking read); a hit is promoted to memory. Counts the miss."""
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text = ?", (model, text)
+                ).fetchone()
+            if row is not None:
+                vec = np.frombuffer(row[0], dtype=np.float32)
+                self._writes.put((model, text, None))
+                with self._lock:
+                    self._remember((model, text), vec)
+                    self.hits += 1
+                return vec
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, model: str, text: str) -> np.ndarray | None:
+        vec = self.get_memory(model, text)
+        return vec if vec is not None else self.get_disk(model, text)
+
+    def put(self, model: str, text: str, vector: Any) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember((model, text), vec)
+        if self._db is not None:
+            self._writes.put((model, text, vec.tobytes()))
+        return vec
+
+    def _remember(self, key: tuple[str, str], vec: np.ndarray) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _write_loop(self) -> None:
+        db = self._connect()
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < _WRITE_BATCH:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            now = time.time()
+            try:
+                for model, text, data in batch:
+                    if data is None:
+                        db.execute(
+                            "UPDATE embeddings SET last_used = ? WHERE model = ? AND text = ?", (now, model, text)
+                        )
+                    else:
+                        cur = db.execute(
+                            "INSERT OR IGNORE INTO embeddings (model, text, vector, last_used) VALUES (?, ?, ?, ?)",
+                            (model, text, data, now),
+                        )
+                        self._disk_rows += cur.rowcount
+                if 0 < self.max_disk_rows < self._disk_rows / _PRUNE_SLACK:
+                    self._prune(db)
+                db.commit()
+            except sqlite3.Error:
+                db.rollback()
+            finally:
+                for _ in batch:
+                    self._writes.task_done()
+
+    def _prune(self, db: sqlite3.Connection) -> None:
+        """Delete the least recently used rows down to max_disk_rows."""
+        db.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_rows,),
+        )
+        self._disk_rows = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def flush(self) -> None:
+        """Wait until queued disk writes are committed."""
+        if self._writer is not None:
+            self._writes.join()
+
+    def clear(self) -> None:
+        """Drop the in-memory tier and counters (the SQLite tier is kept)."""
+        with self._lock:
+            self._lru.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._lru),
+        }
+
+
+_cache: EmbeddingCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache | None:
+    """Process-wide cache from config; None when EMBEDDING_CACHE_SIZE is 0."""
+    global _cache
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = Path(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else None
+                _cache = EmbeddingCache(EMBEDDING_CACHE_SIZE, path)
+    return _cache
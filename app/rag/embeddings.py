@@ -0,0 +1,226 @@
+"""
+Embedding providers: the remote OpenAI-compatible API or a local CPU model
+(sentence-transformers, optionally an ONNX / quantized ONNX export).
+Index builder and retriever embed through the same interface; model_id is recorded in the
+index manifest so an index is never queried with vectors from a different model.
+"""
+import logging
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+
+from app.config import (
+    EMBEDDING_CONCURRENCY,
+    EMBEDDING_LOCAL_BATCH_SIZE,
+    EMBEDDING_ONNX_FILE,
+    EMBEDDING_PROVIDER,
+    EMBEDDING_THREADS,
+    LOCAL_EMBEDDING_MODEL,
+    OPENAI_EMBEDDING_MODEL,
+)
+from app.rag.clients import get_async_openai_client, get_openai_client
+from app.rag.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_PROVIDERS = ("openai", "local", "onnx")
+
+
+class EmbeddingProvider(ABC):
+    """
+    embed(texts) -> float32 matrix (rows not normalized) for one batch.
+    model_id identifies the vector space (provider + model); dimension is None until known.
+    """
+
+    name = ""
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def model_id(self) -> str:
+        return f"{self.name}:{self.model}"
+
+    @property
+    def dimension(self) -> int | None:
+        return None
+
+    @property
+    def concurrency(self) -> int:
+        """Parallel batches during index builds."""
+        return 1
+
+    @abstractmethod
+    def embed(self, texts: list[str]) -> np.ndarray:
+        ...
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        return await run_blocking(self.embed, texts)
+
+    def for_bulk(self) -> "EmbeddingProvider":
+        """Variant for index builds (the builder does its own retries)."""
+        return self
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    name = "openai"
+
+    def __init__(self, client: OpenAI, aclient: AsyncOpenAI | None, model: str):
+        super().__init__(model)
+        self._client = client
+        self._aclient = aclient
+
+    @property
+    def concurrency(self) -> int:
+        return max(1, EMBEDDING_CONCURRENCY)
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        resp = self._client.embeddings.create(input=texts, model=self.model)
+        return np.array([e.embedding for e in resp.data], dtype=np.float32)
+
+    async def aembed(self, texts: list[str]) -> np.ndarray:
+        if self._aclient is None:
+            return await super().aembed(texts)
+        resp = await self._aclient.embeddings.create(input=texts, model=self.model)
+        return np.array([e.embedding for e in resp.data], dtype=np.float32)
+
+    @property
+    def model_id(self) -> str:
+        # Просто имя модели: совпадает с манифестами и кэшами, собранными до появления провайдеров
+        return self.model
+
+    def for_bulk(self) -> "OpenAIEmbeddingProvider":
+        return OpenAIEmbeddingProvider(self._client.with_options(max_retries=0), None, self.model)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    sentence-transformers on CPU with batched inference. backend="onnx" runs an ONNX export
+    through onnxruntime; onnx_file selects a specific (e.g. quantized int8) file of the model repo.
+    Weights are loaded once, on first use.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        backend: str = "torch",
+        onnx_file: str = "",
+        threads: int = 0,
+        batch_size: int = 32,
+    ):
+        super().__init__(model)
+        self.name = "onnx" if backend == "onnx" else "local"
+        self.backend = backend
+        self.onnx_file = onnx_file
+        self.threads = threads
+        self.batch_size = batch_size
+        self._model: Any = None
+        self._lock = threading.Lock()
+
+    @property
+    def model_id(self) -> str:
+        if self.backend == "onnx" and self.onnx_file:
+            return f"{self.name}:{self.model}:{self.onnx_file}"
+        return f"{self.name}:{self.model}"
+
+    @property
+    def dimension(self) -> int | None:
+        return int(self._get().get_sentence_embedding_dimension())
+
+    def _get(self) -> Any:
+        if self._model is not None:
+            return self._model
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import SentenceTransformer
+                except ImportError:
+                    raise RuntimeError(
+                        "sentence-transformers is required for local embeddings. Install: pip install sentence-transformers"
+                    ) from None
+                kwargs: dict[str, Any] = {"device": "cpu"}
+                if self.backend == "onnx":
+                    kwargs["backend"] = "onnx"
+                    kwargs["model_kwargs"] = self._onnx_kwargs()
+                elif self.threads > 0:
+                    import torch
+                    torch.set_num_threads(self.threads)
+                self._model = SentenceTransformer(self.model, **kwargs)
+                logger.info("Embedding model loaded: %s (%s)", self.model, self.backend)
+        return self._model
+
+    def _onnx_kwargs(self) -> dict[str, Any]:
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError(
+                "onnxruntime is required for ONNX embeddings. Install: pip install \"sentence-transformers[onnx]\""
+            ) from None
+        model_kwargs: dict[str, Any] = {"provider": "CPUExecutionProvider"}
+        if self.onnx_file:
+            model_kwargs["file_name"] = self.onnx_file
+        if self.threads > 0:
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.threads
+            model_kwargs["session_options"] = options
+        return model_kwargs
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        vectors = self._get().encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+
+@lru_cache(maxsize=8)
+def get_embedding_provider(
+    api_key: str | None = None,
+    base_url: str | None = None,
+    model: str | None = None,
+) -> EmbeddingProvider:
+    """
+    Shared provider selected by EMBEDDING_PROVIDER (openai | local | onnx).
+    model overrides OPENAI_EMBEDDING_MODEL / LOCAL_EMBEDDING_MODEL.
+    """
+    if EMBEDDING_PROVIDER == "openai":
+        return OpenAIEmbeddingProvider(
+            get_openai_client(api_key, base_url),
+            get_async_openai_client(api_key, base_url),
+            model or OPENAI_EMBEDDING_MODEL,
+        )
+    if EMBEDDING_PROVIDER in ("local", "onnx"):
+        return LocalEmbeddingProvider(
+            model or LOCAL_EMBEDDING_MODEL,
+            backend="onnx" if EMBEDDING_PROVIDER == "onnx" else "torch",
+            onnx_file=EMBEDDING_ONNX_FILE,
+            threads=EMBEDDING_THREADS,
+            batch_size=EMBEDDING_LOCAL_BATCH_SIZE,
+        )
+    raise ValueError(
+        f"Unknown EMBEDDING_PROVIDER: {EMBEDDING_PROVIDER!r} (expected one of {', '.join(EMBEDDING_PROVIDERS)})"
+    )
+
+
+def check_index_embedding(manifest: dict[str, Any], provider: EmbeddingProvider, index_dim: int) -> None:
+    """Refuse an index whose manifest records a different embedding model or dimension."""
+    info = manifest.get("embedding")
+    if info is None:
+        # Манифесты до появления провайдеров: только имя модели OpenAI в settings
+        legacy = manifest.get("settings", {}).get("embedding_model")
+        info = {"model_id": legacy} if legacy else {}
+    built_with = info.get("model_id")
+    if built_with and built_with != provider.model_id:
+        raise ValueError(
+            f"Index was built with embedding model {built_with}, but {provider.model_id} is configured. "
+            "Rebuild the index (python -m app.rag.index_builder) or change EMBEDDING_PROVIDER / the model."
+        )
+    dim = info.get("dimension")
+    if dim is not None and dim != index_dim:
+        raise ValueError(f"Index dimension {index_dim} does not match the manifest ({dim}); rebuild the index")
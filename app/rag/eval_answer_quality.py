@@ -20,11 +20,11 @@ def main() -> None:
     retriever = RAGRetriever()
     retriever.load()
 
-    for query in SAMPLE_QUERIES:
+    batch = retriever.search_batch(SAMPLE_QUERIES, top_k=TOP_K)
+    for query, contexts in zip(SAMPLE_QUERIES, batch):
         print("\n" + "=" * 70)
         print("ЗАПРОС:", query)
         print("=" * 70)
-        contexts = retriever.search(query, top_k=TOP_K)
         if not contexts:
             print("Чанков не найдено.\n")
             continue
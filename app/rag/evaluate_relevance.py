@@ -27,8 +27,8 @@ def main() -> None:
     print(f"TOP_K={TOP_K}, MIN_RELEVANCE_SCORE={MIN_RELEVANCE_SCORE}")
     print("=" * 60)
 
-    for q in SAMPLE_QUERIES:
-        results = retriever.search(q, top_k=TOP_K, min_score=0.0)  # без фильтра — смотрим все score
+    batch = retriever.search_batch(SAMPLE_QUERIES, top_k=TOP_K, min_score=0.0)  # без фильтра — смотрим все score
+    for q, results in zip(SAMPLE_QUERIES, batch):
         scores = [r["score"] for r in results]
         all_scores.extend(scores)
         mean_s = statistics.mean(scores) if scores else 0
@@ -0,0 +1,117 @@
+"""
+Metadata filters for retrieval: restrict a search to source path prefixes and / or document tags.
+Tags come from the frontmatter of a document (tags: [a, b], tags: a, b or a YAML list) and are
+stored per source in the chunk store; a filter resolves to a per-source mask once per index
+generation, and the retriever pushes it into FAISS (IDSelector) and BM25 (posting mask).
+Per-chat filters are configured in CHAT_FILTERS (JSON: {"<chat_id>" | "*": {"sources": [...], "tags": [...]}}).
+"""
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+
+from app.config import CHAT_FILTERS
+
+_FRONTMATTER_RE = re.compile(r"\A\ufeff?---[ \t]*\r?\n(.*?)\r?\n(?:---|\.\.\.)[ \t]*(?:\r?\n|\Z)", re.S)
+_TAG_KEYS = ("tags", "tag")
+_TAG_SPLIT_RE = re.compile(r"[,\s]+")
+
+
+def _normalize_tags(raw: list[str]) -> list[str]:
+    tags: list[str] = []
+    for tag in raw:
+        tag = tag.strip().strip("'\"").lstrip("#").strip().lower()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def frontmatter_tags(text: str) -> list[str]:
+    """Tags from the frontmatter block at the start of text (lowercase, without '#'); [] without one."""
+    match = _FRONTMATTER_RE.match(text)
+    if not match:
+        return []
+    lines = match.group(1).splitlines()
+    for i, line in enumerate(lines):
+        key, sep, value = line.partition(":")
+        if not sep or line[:1].isspace() or key.strip().lower() not in _TAG_KEYS:
+            continue
+        value = value.strip()
+        if value:
+            return _normalize_tags(_TAG_SPLIT_RE.split(value.strip("[]")))
+        # Список YAML на следующих строках: "  - tag"
+        items: list[str] = []
+        for item in lines[i + 1:]:
+            item = item.strip()
+            if not item.startswith("-"):
+                break
+            items.append(item[1:])
+        return _normalize_tags(items)
+    return []
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """
+    Chunks whose source_path starts with one of sources (if any) and whose document has one of
+    tags (if any). An empty filter matches everything.
+    """
+
+    sources: tuple[str, ...] = ()
+    tags: tuple[str, ...] = ()
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "SearchFilter":
+        unknown = set(data) - {"sources", "tags"}
+        if unknown:
+            raise ValueError(f"Unknown search filter keys: {', '.join(sorted(unknown))}")
+        sources = data.get("sources") or []
+        tags = data.get("tags") or []
+        if isinstance(sources, str) or isinstance(tags, str):
+            raise ValueError("Search filter sources and tags must be lists")
+        return cls(
+            tuple(sorted({str(s).replace("\\", "/").lstrip("/") for s in sources})),
+            tuple(_normalize_tags(sorted(str(t) for t in tags))),
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.sources or self.tags)
+
+    def source_mask(self, sources: list[str], source_tags: list[list[str]]) -> np.ndarray:
+        """bool per entry of the chunk store source table: does the filter accept chunks of this source."""
+        wanted = set(self.tags)
+        mask = np.ones(len(sources), dtype=bool)
+        for i, path in enumerate(sources):
+            if self.sources and not path.replace("\\", "/").startswith(self.sources):
+                mask[i] = False
+            elif wanted and wanted.isdisjoint(source_tags[i]):
+                mask[i] = False
+        return mask
+
+
+@lru_cache(maxsize=1)
+def _chat_filters() -> dict[str, SearchFilter]:
+    if not CHAT_FILTERS.strip():
+        return {}
+    try:
+        data = json.loads(CHAT_FILTERS)
+    except ValueError as e:
+        raise ValueError(f"CHAT_FILTERS is not valid JSON: {e}") from e
+    if not isinstance(data, dict) or not all(isinstance(v, dict) for v in data.values()):
+        raise ValueError('CHAT_FILTERS must map chat ids (or "*") to {"sources": [...], "tags": [...]}')
+    return {str(chat): SearchFilter.from_dict(spec) for chat, spec in data.items()}
+
+
+def configured_filters() -> list[SearchFilter]:
+    """Distinct non-empty filters of CHAT_FILTERS (resolved up front when an index generation loads)."""
+    return [flt for flt in dict.fromkeys(_chat_filters().values()) if flt]
+
+
+def chat_filter(chat_id: int | str) -> SearchFilter | None:
+    """Filter configured for chat_id in CHAT_FILTERS ("*" = every other chat); None = whole index."""
+    filters = _chat_filters()
+    flt = filters.get(str(chat_id), filters.get("*"))
+    return flt or None
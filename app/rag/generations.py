@@ -0,0 +1,67 @@
+"""
+Versioned index directories. Every build is written to INDEX_PATH/generations/<name>/ and then
+published by atomically replacing the INDEX_PATH/current pointer (a one-line text file), so a
+reader never sees a half-written index. Without a pointer the files directly in INDEX_PATH are
+used (layout of builds made before generations).
+"""
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+GENERATIONS_DIR = "generations"
+CURRENT_FILE = "current"
+
+
+def read_current(index_path: Path) -> str | None:
+    """Name of the published generation, or None for the legacy layout."""
+    try:
+        name = (index_path / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return name or None
+
+
+def generation_path(index_path: Path, name: str | None = None) -> Path:
+    """Directory of generation name (default: the current one); index_path itself for the legacy layout."""
+    name = name or read_current(index_path)
+    return index_path / GENERATIONS_DIR / name if name else index_path
+
+
+def new_generation(index_path: Path) -> Path:
+    """Create an empty directory for the next build; names sort in creation order."""
+    root = index_path / GENERATIONS_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    while True:
+        path = root / datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        try:
+            path.mkdir()
+            return path
+        except FileExistsError:
+            continue
+
+
+def publish_generation(index_path: Path, name: str) -> None:
+    """Point current at generation name (write a temp file, then os.replace — atomic on POSIX)."""
+    tmp = index_path / f".{CURRENT_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(name + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, index_path / CURRENT_FILE)
+
+
+def prune_generations(index_path: Path, keep: int) -> list[str]:
+    """
+    Delete all but the newest keep generations; the current one is never deleted.
+    A process still serving a deleted generation keeps its open / memory-mapped files.
+    """
+    root = index_path / GENERATIONS_DIR
+    if keep <= 0 or not root.is_dir():
+        return []
+    current = read_current(index_path)
+    names = sorted((p.name for p in root.iterdir() if p.is_dir()), reverse=True)
+    removed = [name for name in names[keep:] if name != current]
+    for name in removed:
+        shutil.rmtree(root / name, ignore_errors=True)
+    return removed
@@ -1,10 +1,19 @@
 """Build vector index from knowledge base directory."""
+import argparse
+import hashlib
 import json
+import os
+import random
+import shutil
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, Iterator
 
 import numpy as np
-from openai import OpenAI
+from openai import APIConnectionError, APIStatusError, RateLimitError
 
 try:
     import faiss
@@ -14,13 +23,52 @@ except ImportError:
 from app.config import (
     CHUNK_OVERLAP,
     CHUNK_SIZE,
+    EMBEDDING_BATCH_MAX_TOKENS,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_MAX_RETRIES,
+    EMBEDDING_PROVIDER,
+    EMBEDDING_RETRY_BASE_DELAY,
+    EMBEDDING_RETRY_MAX_DELAY,
+    FAISS_EF_SEARCH,
+    FAISS_NPROBE,
+    INDEX_EF_CONSTRUCTION,
+    INDEX_HNSW_M,
+    INDEX_KEEP_GENERATIONS,
+    INDEX_NLIST,
     INDEX_PATH,
+    INDEX_PQ_M,
+    INDEX_RECALL_QUERIES,
+    INDEX_TRAIN_SAMPLE,
+    INDEX_TYPE,
+    INGEST_QUEUE_SIZE,
+    INGEST_WORKERS,
     KNOWLEDGE_BASE_PATH,
-    OPENAI_API_BASE,
     OPENAI_API_KEY,
-    OPENAI_EMBEDDING_MODEL,
+    TOP_K,
 )
+from app.rag.ann_index import (
+    INDEX_TYPES,
+    apply_search_params,
+    index_kind,
+    make_index,
+    recall_at_k,
+    supports_remove,
+)
+from app.rag.bm25 import BM25Builder
+from app.rag.chunk_store import (
+    LEGACY_METADATA_FILE,
+    MANIFEST_FILE,
+    ChunkStore,
+    ChunkStoreWriter,
+    convert_json_metadata,
+    open_chunk_store,
+    store_exists,
+)
+from app.rag.embeddings import EmbeddingProvider, get_embedding_provider
+from app.rag.filters import frontmatter_tags
+from app.rag.generations import generation_path, new_generation, prune_generations, publish_generation
 from app.rag.text_cleaning import clean_text, should_skip_path
+from app.rag.tokens import token_counter
 
 try:
     from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -28,6 +76,17 @@ try:
 except ImportError:
     _LANGCHAIN_SPLITTER = False
 
+# Manifest (MANIFEST_FILE): per-file content hashes and per-chunk hashes of the last build (for --incremental)
+MANIFEST_VERSION = 1
+# Embedded batches of an unfinished build; removed once the index is written
+CHECKPOINT_DIR = ".embed_checkpoint"
+# Vectors of a new IVF / PQ (or HNSW, for the recall report) build, spilled to disk until training
+SPILL_FILE = "vectors.f32"
+# Files handed to the process pool ahead of the consumer, per worker
+_INGEST_PREFETCH = 4
+# Rows per add_with_ids call when filling an index from the spill file
+_ADD_BLOCK = 65536
+
 
 def _read_file(path: Path, encoding: str = "utf-8") -> str:
     try:
@@ -96,32 +155,358 @@ def _chunk_text(text: str, chunk_size: int, overlap: int) -> list[str]:
     return chunks
 
 
-def _collect_documents(base_path: Path) -> list[tuple[Path, str]]:
-    """Recursively collect .md and .txt files (skip macOS ._*); return (path, cleaned content)."""
-    out: list[tuple[Path, str]] = []
+def _discover_files(base_path: Path) -> list[Path]:
+    """Recursively list .md and .txt files (skip macOS ._*) in a stable order."""
+    out: list[Path] = []
     for ext in (".md", ".txt"):
         for path in base_path.rglob(f"*{ext}"):
-            if not path.is_file() or should_skip_path(path):
-                continue
-            raw = _read_file(path)
-            content = clean_text(raw)
-            if content.strip():
-                out.append((path, content))
-    return out
-
-
-def _get_embeddings(client: OpenAI, texts: list[str], model: str) -> list[list[float]]:
-    """Batch embed texts (OpenAI allows batch)."""
-    if not texts:
-        return []
-    batch_size = 100
-    all_embeddings: list[list[float]] = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
-        resp = client.embeddings.create(input=batch, model=model)
-        for e in resp.data:
-            all_embeddings.append(e.embedding)
-    return all_embeddings
+            if path.is_file() and not should_skip_path(path):
+                out.append(path)
+    return sorted(out)
+
+
+def _relative(path: Path, base_path: Path) -> str:
+    return str(path.relative_to(base_path) if path.is_relative_to(base_path) else path)
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=4)
+def _make_splitter(chunk_size: int, chunk_overlap: int) -> Callable[[str], list[str]]:
+    if _LANGCHAIN_SPLITTER:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=["\n\n", "\n", " ", ""],
+            length_function=len,
+        )
+        return splitter.split_text
+    return lambda content: _chunk_text(content, chunk_size, chunk_overlap)
+
+
+def _chunk_document(content: str, rel_path: str, split: Callable[[str], list[str]]) -> list[dict[str, Any]]:
+    chunks: list[dict[str, Any]] = []
+    for i, chunk_text in enumerate(split(content)):
+        if not chunk_text.strip():
+            continue
+        chunks.append({
+            "text": chunk_text.strip(),
+            "source_path": rel_path,
+            "chunk_index": i,
+        })
+    return chunks
+
+
+def _ingest_file(
+    path: Path, rel_path: str, chunk_size: int, chunk_overlap: int, old_hash: str | None
+) -> tuple[str, str, list[str], list[dict[str, Any]] | None]:
+    """
+    Read, clean and chunk one file (runs in a worker process).
+    Returns (rel_path, content hash, frontmatter tags, chunks); chunks is None when the hash equals old_hash.
+    """
+    raw = _read_file(path)
+    file_hash = _content_hash(raw)
+    tags = frontmatter_tags(raw)
+    if file_hash == old_hash:
+        return rel_path, file_hash, tags, None
+    content = clean_text(raw)
+    split = _make_splitter(chunk_size, chunk_overlap)
+    return rel_path, file_hash, tags, _chunk_document(content, rel_path, split) if content.strip() else []
+
+
+def _ingest(
+    files: list[Path],
+    rel_paths: list[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    old_hashes: dict[str, str],
+    workers: int,
+) -> Iterator[tuple[str, str, list[str], list[dict[str, Any]] | None]]:
+    """
+    _ingest_file for every file, yielded in the order of files. With workers > 1 the files are
+    processed by a process pool at most workers * _INGEST_PREFETCH files ahead of the consumer,
+    so neither the documents nor their chunks pile up while the embedding stage is busy.
+    """
+    jobs = ((path, rel, chunk_size, chunk_overlap, old_hashes.get(rel)) for path, rel in zip(files, rel_paths))
+    if workers <= 1:
+        for job in jobs:
+            yield _ingest_file(*job)
+        return
+    pending: deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            for job in jobs:
+                pending.append(pool.submit(_ingest_file, *job))
+                if len(pending) >= workers * _INGEST_PREFETCH:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _is_retryable(err: Exception) -> bool:
+    if isinstance(err, (APIConnectionError, RateLimitError)):  # APITimeoutError is an APIConnectionError
+        return True
+    return isinstance(err, APIStatusError) and err.status_code >= 500
+
+
+def _retry_after(err: Exception) -> float:
+    response = getattr(err, "response", None)
+    try:
+        return float(response.headers.get("retry-after", 0)) if response is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _embed_batch(provider: EmbeddingProvider, batch: list[str]) -> np.ndarray:
+    """One embeddings request with exponential backoff (and Retry-After) on 429 / 5xx / network errors."""
+    delay = EMBEDDING_RETRY_BASE_DELAY
+    for attempt in range(EMBEDDING_MAX_RETRIES + 1):
+        try:
+            return provider.embed(batch)
+        except Exception as e:
+            if attempt >= EMBEDDING_MAX_RETRIES or not _is_retryable(e):
+                raise
+            wait = max(delay, _retry_after(e)) * (1 + random.random() * 0.25)
+            print(f"Embedding request failed ({e.__class__.__name__}), retry {attempt + 1} in {wait:.1f}s")
+            time.sleep(wait)
+            delay = min(delay * 2, EMBEDDING_RETRY_MAX_DELAY)
+    raise AssertionError("unreachable")
+
+
+class _EmbeddingCheckpoint:
+    """Finished batches saved as .npy files keyed by (model, batch texts); lets an interrupted build resume."""
+
+    def __init__(self, directory: Path, model: str):
+        self.directory = directory
+        self.model = model
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, batch: list[str]) -> Path:
+        h = hashlib.sha256(self.model.encode("utf-8"))
+        for text in batch:
+            h.update(b"\0")
+            h.update(text.encode("utf-8"))
+        return self.directory / f"{h.hexdigest()}.npy"
+
+    def load(self, batch: list[str]) -> np.ndarray | None:
+        path = self._path(batch)
+        if not path.is_file():
+            return None
+        try:
+            arr = np.load(path)
+        except (OSError, ValueError):
+            return None
+        return arr if arr.shape[0] == len(batch) else None
+
+    def save(self, batch: list[str], vectors: np.ndarray) -> None:
+        path = self._path(batch)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp, path)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class _EmbeddingPipeline:
+    """
+    Embedding stage of the build. add() groups chunks into request batches capped by
+    EMBEDDING_BATCH_SIZE texts and EMBEDDING_BATCH_MAX_TOKENS tokens and hands them to
+    provider.concurrency threads (EMBEDDING_CONCURRENCY requests for the API, one batch at a time
+    for a local model). At most queue_size batches are queued or in flight: beyond that add()
+    waits for the oldest one, so ingestion overlaps with embedding without running ahead of it.
+    Results reach sink(ids, vectors) L2-normalized and in submission order.
+    With a checkpoint, finished batches are read from / written to disk.
+    """
+
+    def __init__(
+        self,
+        provider: EmbeddingProvider,
+        sink: Callable[[np.ndarray, np.ndarray], None],
+        checkpoint: _EmbeddingCheckpoint | None = None,
+        queue_size: int = 16,
+    ):
+        self.provider = provider.for_bulk()  # retries are handled by _embed_batch
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.queue_size = max(1, queue_size)
+        self.batches = 0
+        self.restored = 0
+        self.chunks = 0
+        self._count_tokens = token_counter(self.provider.model)
+        self._ids: list[int] = []
+        self._texts: list[str] = []
+        self._tokens = 0
+        self._queue: deque[tuple[list[int], Future]] = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.provider.concurrency)
+
+    def add(self, chunk_id: int, text: str) -> None:
+        n = self._count_tokens(text)
+        if self._texts and (len(self._texts) >= EMBEDDING_BATCH_SIZE or self._tokens + n > EMBEDDING_BATCH_MAX_TOKENS):
+            self._submit()
+        self._ids.append(chunk_id)
+        self._texts.append(text)
+        self._tokens += n
+
+    def _submit(self) -> None:
+        self._queue.append((self._ids, self._pool.submit(self._run, self._texts)))
+        self._ids, self._texts, self._tokens = [], [], 0
+        while len(self._queue) > self.queue_size:
+            self._write_oldest()
+
+    def _run(self, batch: list[str]) -> tuple[np.ndarray, bool]:
+        if self.checkpoint is not None:
+            vectors = self.checkpoint.load(batch)
+            if vectors is not None:
+                return vectors, True
+        vectors = _embed_batch(self.provider, batch)
+        if self.checkpoint is not None:
+            self.checkpoint.save(batch, vectors)
+        return vectors, False
+
+    def _write_oldest(self) -> None:
+        ids, future = self._queue.popleft()
+        vectors, restored = future.result()
+        faiss.normalize_L2(vectors)
+        self.sink(np.array(ids, dtype=np.int64), vectors)
+        self.batches += 1
+        self.restored += restored
+        self.chunks += len(ids)
+        if self.batches % 10 == 0:
+            print(f"Embedded {self.batches} batches ({self.chunks} chunks)")
+
+    def close(self) -> None:
+        """Send the last partial batch and wait for everything in flight."""
+        if self._texts:
+            self._submit()
+        while self._queue:
+            self._write_oldest()
+        self._pool.shutdown()
+        if self.restored:
+            print(f"Resumed: {self.restored}/{self.batches} batches restored from checkpoint")
+
+    def shutdown(self) -> None:
+        """Drop queued batches (after an error or an aborted build)."""
+        self._pool.shutdown(cancel_futures=True)
+
+
+class _IndexWriter:
+    """
+    Receives normalized vectors batch by batch. An existing index (incremental build) and new
+    flat / HNSW indexes take them right away; IVF / PQ types must be trained first, so their
+    vectors go to a float32 spill file and finish() trains on a sample of it and adds it in blocks.
+    The spill file of a new approximate index is also the exact baseline for the recall@k report.
+    """
+
+    def __init__(self, kind: str, index: Any = None, spill_path: Path | None = None):
+        self.kind = kind
+        self.index = index
+        self.spill_path = spill_path
+        self._spill = open(spill_path, "wb") if spill_path is not None else None
+        self._ids: list[np.ndarray] = []
+        self._dim = 0
+
+    def _make(self, vectors: np.ndarray) -> Any:
+        # inner product; embeddings are normalized
+        return make_index(
+            self.kind,
+            vectors,
+            nlist=INDEX_NLIST,
+            hnsw_m=INDEX_HNSW_M,
+            ef_construction=INDEX_EF_CONSTRUCTION,
+            pq_m=INDEX_PQ_M,
+            train_sample=INDEX_TRAIN_SAMPLE,
+        )
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray) -> None:
+        if self.index is None and self.kind in ("flat", "hnsw"):
+            self.index = self._make(vectors)
+        if self.index is not None:
+            self.index.add_with_ids(vectors, ids)
+        if self._spill is not None:
+            self._spill.write(vectors.tobytes())
+            self._ids.append(ids)
+            self._dim = vectors.shape[1]
+
+    def finish(self) -> Any:
+        if self._spill is None:
+            return self.index
+        self._spill.close()
+        if self._ids:
+            ids = np.concatenate(self._ids)
+            vectors = np.memmap(self.spill_path, dtype=np.float32, mode="r", shape=(len(ids), self._dim))
+            if self.index is None:
+                self.index = self._make(vectors)
+                for start in range(0, len(ids), _ADD_BLOCK):
+                    block = np.ascontiguousarray(vectors[start:start + _ADD_BLOCK])
+                    self.index.add_with_ids(block, ids[start:start + _ADD_BLOCK])
+            if INDEX_RECALL_QUERIES > 0:
+                apply_search_params(self.index, FAISS_NPROBE, FAISS_EF_SEARCH)
+                recall = recall_at_k(self.index, vectors, ids, TOP_K, INDEX_RECALL_QUERIES)
+                built = index_kind(self.index)
+                label = built if built == self.kind else f"{built} (requested {self.kind})"
+                print(
+                    f"Recall@{TOP_K} of {label} vs flat: {recall:.3f} "
+                    f"({min(INDEX_RECALL_QUERIES, len(ids))} queries, nprobe={FAISS_NPROBE}, efSearch={FAISS_EF_SEARCH})"
+                )
+            del vectors
+        self.spill_path.unlink(missing_ok=True)
+        return self.index
+
+
+def _build_settings(chunk_size: int, chunk_overlap: int, index_type: str, embedding_model: str) -> dict[str, Any]:
+    """Parameters that must match for an incremental build to be equivalent to a full one."""
+    settings: dict[str, Any] = {
+        "embedding_model": embedding_model,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "splitter": "langchain" if _LANGCHAIN_SPLITTER else "builtin",
+        "index_type": index_type,
+    }
+    if index_type == "hnsw":
+        settings.update(hnsw_m=INDEX_HNSW_M, ef_construction=INDEX_EF_CONSTRUCTION)
+    elif index_type != "flat":
+        settings.update(nlist=INDEX_NLIST, pq_m=INDEX_PQ_M)
+    return settings
+
+
+def _load_previous(idx_path: Path, settings: dict[str, Any]) -> tuple[Any, ChunkStore, dict[str, Any]] | None:
+    """
+    Return (index, chunk store, manifest) of the current build if it can be updated incrementally.
+    The chunk store stays mmapped: old chunks are read only for the files that are reused.
+    """
+    src = generation_path(idx_path)
+    index_file = src / "index.faiss"
+    manifest_file = src / MANIFEST_FILE
+    has_chunks = store_exists(src) or (src / LEGACY_METADATA_FILE).is_file()
+    if not (index_file.is_file() and has_chunks and manifest_file.is_file()):
+        return None
+    manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != settings:
+        return None
+    index = faiss.read_index(str(index_file))
+    return index, open_chunk_store(src), manifest
+
+
+def _write_index(idx_path: Path, gen_dir: Path, index: Any, manifest: dict[str, Any]) -> None:
+    """
+    Finish the generation directory (chunk store and BM25 are already in it) and publish it (atomic
+    switch of the current pointer); a running bot picks it up without a restart.
+    """
+    faiss.write_index(index, str(gen_dir / "index.faiss"))
+    (gen_dir / MANIFEST_FILE).write_text(
+        json.dumps(manifest, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    publish_generation(idx_path, gen_dir.name)
+    for name in prune_generations(idx_path, INDEX_KEEP_GENERATIONS):
+        print(f"Removed old index generation {name}")
 
 
 def build_index(
@@ -129,8 +514,23 @@ def build_index(
     index_path: Path | None = None,
     chunk_size: int | None = None,
     chunk_overlap: int | None = None,
+    incremental: bool = False,
+    index_type: str | None = None,
 ) -> None:
-    """Index all .md/.txt under knowledge_base_path; save FAISS index + metadata to index_path."""
+    """
+    Index all .md/.txt under knowledge_base_path; save FAISS index + metadata as a new generation
+    under index_path and switch index_path/current to it (see app.rag.generations).
+    incremental=True reuses the previous build: only files whose content hash changed are
+    re-chunked, only chunks with a new hash are embedded, and vectors of removed chunks are
+    dropped via FAISS id mapping. Falls back to a full build when there is nothing to reuse.
+    index_type selects exact or approximate search (see ann_index.INDEX_TYPES); approximate
+    full builds print recall@k against the flat baseline.
+    Files are read, cleaned and chunked by INGEST_WORKERS processes while earlier chunks are
+    being embedded (at most INGEST_QUEUE_SIZE batches in flight); vectors are appended to the
+    index as they arrive, chunk texts are streamed into the new generation's chunk store and BM25
+    postings are accumulated per chunk, so memory holds neither the documents, nor the chunk texts,
+    nor a full embedding matrix (only per-chunk ids / offsets and compact BM25 postings).
+    """
     if faiss is None:
         raise RuntimeError("faiss-cpu is required for indexing. Install: pip install faiss-cpu")
 
@@ -138,9 +538,13 @@ def build_index(
     idx_path = index_path or INDEX_PATH
     cs = chunk_size if chunk_size is not None else CHUNK_SIZE
     co = chunk_overlap if chunk_overlap is not None else CHUNK_OVERLAP
+    kind = (index_type or INDEX_TYPE).lower()
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {kind!r}; expected one of {', '.join(INDEX_TYPES)}")
 
-    if not OPENAI_API_KEY:
+    if EMBEDDING_PROVIDER == "openai" and not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY is not set")
+    provider = get_embedding_provider()
 
     kb = kb.resolve()
     if not kb.is_dir():
@@ -149,53 +553,162 @@ def build_index(
     idx_path = idx_path.resolve()
     idx_path.mkdir(parents=True, exist_ok=True)
 
-    documents = _collect_documents(kb)
-    if not documents:
+    files = _discover_files(kb)
+    if not files:
         raise ValueError(f"No .md or .txt files found under {kb}")
 
-    chunks: list[dict[str, Any]] = []
-    if _LANGCHAIN_SPLITTER:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=cs,
-            chunk_overlap=co,
-            separators=["\n\n", "\n", " ", ""],
-            length_function=len,
+    settings = _build_settings(cs, co, kind, provider.model_id)
+    previous = _load_previous(idx_path, settings) if incremental else None
+    if incremental and previous is None:
+        print("No compatible previous build found, running a full build")
+    index, old_store, old_manifest = previous if previous is not None else (None, None, {"files": {}})
+    # chunk id -> position in the previous chunk store
+    old_by_id = {int(cid): pos for pos, cid in enumerate(old_store.ids)} if old_store is not None else {}
+    next_id = old_manifest.get("next_id", 0)
+
+    old_files: dict[str, Any] = old_manifest["files"]
+    rel_paths = [_relative(path, kb) for path in files]
+    removable = index is None or supports_remove(index)
+    if not removable and set(old_files) - set(rel_paths):
+        print(f"{kind} index cannot drop vectors, running a full build")
+        return build_index(kb, idx_path, cs, co, incremental=False, index_type=kind)
+
+    # Новый IVF/PQ индекс обучается в конце на векторах из spill-файла; HNSW — только для отчёта recall
+    spill = previous is None and kind != "flat" and (kind != "hnsw" or INDEX_RECALL_QUERIES > 0)
+    checkpoint = _EmbeddingCheckpoint(idx_path / CHECKPOINT_DIR, provider.model_id)
+    writer = _IndexWriter(kind, index, checkpoint.directory / SPILL_FILE if spill else None)
+    pipeline = _EmbeddingPipeline(provider, writer.add, checkpoint, INGEST_QUEUE_SIZE)
+    workers = max(1, min(INGEST_WORKERS or os.cpu_count() or 1, len(files)))
+    ingested = _ingest(files, rel_paths, cs, co, {rel: f["hash"] for rel, f in old_files.items()}, workers)
+    gen_dir = new_generation(idx_path)
+    store = ChunkStoreWriter(gen_dir)
+    bm25 = BM25Builder()
+
+    files_manifest: dict[str, Any] = {}
+    kept_ids: set[int] = set()
+    n_changed = 0
+    n_embedded = 0
+    full_rebuild = False
+    try:
+        for rel_path, file_hash, tags, file_chunks in ingested:
+            old_file = old_files.get(rel_path)
+            if file_chunks is None:
+                # Unchanged file: reuse chunks and vectors as they are
+                file_chunks = [old_store[old_by_id[cid]] for cid, _ in old_file["chunks"]]
+                chunk_hashes = [h for _, h in old_file["chunks"]]
+                kept_ids.update(c["id"] for c in file_chunks)
+            else:
+                n_changed += 1
+                chunk_hashes = [_content_hash(c["text"]) for c in file_chunks]
+                # Same text in the same file keeps its id (and vector); everything else is embedded
+                reusable: dict[str, list[int]] = {}
+                for cid, h in (old_file or {}).get("chunks", []):
+                    reusable.setdefault(h, []).append(cid)
+                for c, h in zip(file_chunks, chunk_hashes):
+                    ids = reusable.get(h)
+                    if ids:
+                        c["id"] = ids.pop(0)
+                        kept_ids.add(c["id"])
+                    else:
+                        c["id"] = next_id
+                        next_id += 1
+                        pipeline.add(c["id"], c["text"])
+                        n_embedded += 1
+                if not removable and any(reusable.values()):
+                    full_rebuild = True
+                    break
+            files_manifest[rel_path] = {
+                "hash": file_hash,
+                "chunks": [[c["id"], h] for c, h in zip(file_chunks, chunk_hashes)],
+            }
+            # Тексты сразу уходят в хранилище чанков и постинги BM25, в памяти не копятся.
+            # Теги — атрибут документа для фильтров поиска; у переиспользованных чанков тоже обновляются
+            for c in file_chunks:
+                c["tags"] = tags
+                store.add(c)
+                bm25.add(c["text"])
+        if not full_rebuild:
+            pipeline.close()
+            if not len(store):
+                raise ValueError("No text chunks produced from documents")
+            n_chunks = store.close()
+            bm25.build().save(gen_dir)
+            index = writer.finish()
+            removed_ids = [cid for cid in old_by_id if cid not in kept_ids]
+            if removed_ids:
+                index.remove_ids(np.array(removed_ids, dtype=np.int64))
+    except BaseException:
+        store.abort()
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        raise
+    finally:
+        ingested.close()
+        pipeline.shutdown()
+    if full_rebuild:
+        store.abort()
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        print(f"{kind} index cannot drop vectors, running a full build")
+        return build_index(kb, idx_path, cs, co, incremental=False, index_type=kind)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "settings": settings,
+        "embedding": {
+            "provider": provider.name,
+            "model": provider.model,
+            "model_id": provider.model_id,
+            "dimension": int(index.d),
+        },
+        # settings.index_type is the requested type (it must match for --incremental);
+        # index_type is what was built, e.g. ivf_flat when too few vectors to train PQ
+        "index_type": index_kind(index),
+        "next_id": next_id,
+        "files": files_manifest,
+    }
+    try:
+        _write_index(idx_path, gen_dir, index, manifest)
+    except BaseException:
+        shutil.rmtree(gen_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(idx_path / CHECKPOINT_DIR, ignore_errors=True)
+    if previous is not None:
+        print(
+            f"Index updated: {n_changed} changed files, {n_embedded} chunks embedded, "
+            f"{len(removed_ids)} removed; {n_chunks} chunks, saved to {gen_dir}"
         )
-    for path, content in documents:
-        rel_path = path.relative_to(kb) if path.is_relative_to(kb) else path
-        if _LANGCHAIN_SPLITTER:
-            chunk_texts = splitter.split_text(content)
-        else:
-            chunk_texts = _chunk_text(content, cs, co)
-        for i, chunk_text in enumerate(chunk_texts):
-            if not chunk_text.strip():
-                continue
-            chunks.append({
-                "text": chunk_text.strip(),
-                "source_path": str(rel_path),
-                "chunk_index": i,
-            })
-
-    if not chunks:
-        raise ValueError("No text chunks produced from documents")
-
-    client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE)
-    texts = [c["text"] for c in chunks]
-    embeddings = _get_embeddings(client, texts, OPENAI_EMBEDDING_MODEL)
-    matrix = np.array(embeddings, dtype=np.float32)
-
-    index = faiss.IndexFlatIP(matrix.shape[1])  # inner product; embeddings are normalized
-    faiss.normalize_L2(matrix)
-    index.add(matrix)
-
-    faiss.write_index(index, str(idx_path / "index.faiss"))
-    meta_path = idx_path / "metadata.json"
-    meta_path.write_text(
-        json.dumps({"chunks": chunks}, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
-    print(f"Index built: {len(chunks)} chunks, saved to {idx_path}")
+    else:
+        print(f"Index built: {n_chunks} chunks, saved to {gen_dir}")
+
+
+def convert_metadata(index_path: Path | None = None) -> None:
+    """Convert metadata.json of the current build to the binary chunk store in place (old indexes)."""
+    src = generation_path(index_path or INDEX_PATH)
+    if not (src / LEGACY_METADATA_FILE).is_file():
+        raise ValueError(f"No {LEGACY_METADATA_FILE} in {src}")
+    n = convert_json_metadata(src)
+    print(f"Converted {src / LEGACY_METADATA_FILE}: {n} chunks")
 
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build the FAISS index from the knowledge base.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="re-embed only new or changed chunks of the previous build",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default=None,
+        help="FAISS index type (default: INDEX_TYPE from config)",
+    )
+    parser.add_argument(
+        "--convert-metadata",
+        action="store_true",
+        help="convert metadata.json of the current build to the binary chunk store and exit",
+    )
+    args = parser.parse_args()
+    if args.convert_metadata:
+        convert_metadata()
+    else:
+        build_index(incremental=args.incremental, index_type=args.index_type)
@@ -1,8 +1,15 @@
 """RAG answer generation: LangChain ChatOpenAI + structured prompt template."""
+from collections.abc import AsyncIterator
+import time
+from functools import lru_cache
+
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 
-from app.config import OPENAI_API_BASE, OPENAI_API_KEY, OPENAI_MODEL, RAG_SYSTEM_PROMPT
+from app.config import CONTEXT_MAX_TOKENS, OPENAI_API_KEY, OPENAI_MODEL, RAG_SYSTEM_PROMPT
+from app.metrics import CONTEXT_TOKENS, STAGE_SECONDS, count_tokens, timed
+from app.rag.clients import get_chat_model
+from app.rag.concurrency import stage_slot
+from app.rag.context_packer import pack_contexts
 
 _DEFAULT_SYSTEM_PROMPT = """Ты ассистент, отвечающий только на основе приведённого контекста из базы знаний.
 Отвечай ТОЛЬКО на основе контекста ниже. Если в контексте нет информации для ответа — так и скажи.
@@ -45,11 +52,15 @@ def _numbered_context(contexts: list[dict]) -> tuple[str, dict[str, str]]:
     """
     Build context string with [01], [02] prefixes per source_path and return
     mapping source_path -> number for reference.
+    Chunks are packed into CONTEXT_MAX_TOKENS first: neighbouring chunks of a document are
+    merged without their overlap, the lowest-scored ones are dropped when over budget.
     """
+    passages, tokens = pack_contexts(contexts, CONTEXT_MAX_TOKENS, OPENAI_MODEL)
+    CONTEXT_TOKENS.observe(tokens)
     seen: dict[str, str] = {}
     parts: list[str] = []
     num = 1
-    for c in contexts:
+    for c in passages:
         path = c.get("source_path") or "?"
         if path not in seen:
             seen[path] = f"{num:02d}"
@@ -60,6 +71,11 @@ def _numbered_context(contexts: list[dict]) -> tuple[str, dict[str, str]]:
     return "\n\n".join(parts), seen
 
 
+@lru_cache(maxsize=1)
+def _answer_chain():
+    return PROMPT | get_chat_model(max_tokens=2048)
+
+
 def generate_answer(query: str, contexts: list[dict]) -> str:
     """Build numbered context and return LLM answer in the structured template format."""
     if not OPENAI_API_KEY:
@@ -68,13 +84,61 @@ def generate_answer(query: str, contexts: list[dict]) -> str:
         return "По запросу ничего не найдено в базе знаний."
 
     context_block, _ = _numbered_context(contexts)
+    with timed("llm"):
+        msg = _answer_chain().invoke({"context": context_block, "query": query})
+    count_tokens(msg.usage_metadata)
+    return (msg.content or "").strip()
+
+
+async def agenerate_answer(query: str, contexts: list[dict]) -> str:
+    """Async generate_answer: ChatOpenAI.ainvoke (AsyncOpenAI under the hood), does not block the event loop."""
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is not set")
+    if not contexts:
+        return "По запросу ничего не найдено в базе знаний."
 
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL,
-        openai_api_key=OPENAI_API_KEY,
-        base_url=OPENAI_API_BASE,
-        max_tokens=2048,
-    )
-    chain = PROMPT | llm
-    msg = chain.invoke({"context": context_block, "query": query})
+    context_block, _ = _numbered_context(contexts)
+    with timed("llm"):
+        msg = await _answer_chain().ainvoke({"context": context_block, "query": query})
+    count_tokens(msg.usage_metadata)
     return (msg.content or "").strip()
+
+
+async def astream_answer(query: str, contexts: list[dict]) -> AsyncIterator[str]:
+    """
+    Streaming agenerate_answer: yields text deltas as ChatOpenAI.astream produces them.
+    Time to first token is recorded as stage llm_first_token. Stage llm counts only the time spent
+    waiting for the model (awaiting the next chunk), not the time the consumer takes per delta;
+    the global generate slot (stage_slot) is held for those waits only, so a slow consumer
+    (e.g. a chat under Telegram flood control) does not block generation for other chats.
+    """
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY is not set")
+    if not contexts:
+        yield "По запросу ничего не найдено в базе знаний."
+        return
+
+    context_block, _ = _numbered_context(contexts)
+    stream = _answer_chain().astream({"context": context_block, "query": query}).__aiter__()
+    start = time.perf_counter()
+    waited = 0.0
+    first = True
+    try:
+        while True:
+            # Слот generate держим только пока ждём модель, а не пока потребитель правит сообщения
+            async with stage_slot("generate"):
+                t = time.perf_counter()
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    waited += time.perf_counter() - t
+            count_tokens(chunk.usage_metadata)
+            if chunk.content:
+                if first:
+                    STAGE_SECONDS.observe(time.perf_counter() - start, stage="llm_first_token")
+                    first = False
+                yield chunk.content
+    finally:
+        STAGE_SECONDS.observe(waited, stage="llm")
@@ -1,8 +1,9 @@
 """Query expansion: multi-query reformulations for better retrieval."""
+from functools import lru_cache
+
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 
-from app.config import OPENAI_API_BASE, OPENAI_API_KEY, OPENAI_MODEL
+from app.rag.clients import get_chat_model
 
 EXPAND_SYSTEM = """Ты помогаешь переформулировать поисковые запросы. Выводи только переформулировки вопроса, по одной на строку, без нумерации и пояснений. Сохраняй смысл и язык вопроса."""
 
@@ -13,6 +14,24 @@ EXPAND_USER = """Переформулируй следующий вопрос {n
 Переформулировки (по одной на строку):"""
 
 
+@lru_cache(maxsize=1)
+def _expansion_chain():
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", EXPAND_SYSTEM),
+        ("human", EXPAND_USER),
+    ])
+    return prompt | get_chat_model(max_tokens=256)
+
+
+def _parse_variants(query: str, text: str, n_extra: int) -> list[str]:
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()][:n_extra]
+    result = [query]
+    for ln in lines:
+        if ln and ln not in result:
+            result.append(ln)
+    return result
+
+
 def expand_query_multi(query: str, num_variants: int = 3) -> list[str]:
     """
     Return [original_query, reformulation_2, ...] so that total length is num_variants.
@@ -24,22 +43,17 @@ def expand_query_multi(query: str, num_variants: int = 3) -> list[str]:
     if num_variants <= 1:
         return [query]
     n_extra = num_variants - 1
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", EXPAND_SYSTEM),
-        ("human", EXPAND_USER),
-    ])
-    llm = ChatOpenAI(
-        model=OPENAI_MODEL,
-        openai_api_key=OPENAI_API_KEY,
-        base_url=OPENAI_API_BASE,
-        max_tokens=256,
-    )
-    chain = prompt | llm
-    msg = chain.invoke({"query": query, "n": n_extra})
-    text = (msg.content or "").strip()
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()][:n_extra]
-    result = [query]
-    for ln in lines:
-        if ln and ln not in result:
-            result.append(ln)
-    return result
+    msg = _expansion_chain().invoke({"query": query, "n": n_extra})
+    return _parse_variants(query, (msg.content or "").strip(), n_extra)
+
+
+async def aexpand_query_multi(query: str, num_variants: int = 3) -> list[str]:
+    """Async expand_query_multi (ChatOpenAI.ainvoke)."""
+    query = (query or "").strip()
+    if not query:
+        return [query]
+    if num_variants <= 1:
+        return [query]
+    n_extra = num_variants - 1
+    msg = await _expansion_chain().ainvoke({"query": query, "n": n_extra})
+    return _parse_variants(query, (msg.content or "").strip(), n_extra)
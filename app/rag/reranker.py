@@ -1,9 +1,131 @@
 """Cross-encoder reranker: re-rank candidates by (query, chunk) relevance."""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from typing import Any
 
-from app.config import RERANK_API_KEY, RERANK_API_URL, RERANKER_MODEL
+from app.config import (
+    RERANK_API_KEY,
+    RERANK_API_URL,
+    RERANKER_BATCH_SIZE,
+    RERANKER_MICROBATCH_MAX_PAIRS,
+    RERANKER_MICROBATCH_WAIT_MS,
+    RERANKER_MODEL,
+    RERANKER_THREADS,
+)
+from app.metrics import timed
+from app.rag.concurrency import run_blocking, stage_slot
 
+logger = logging.getLogger(__name__)
 
+
+class _CrossEncoderHolder:
+    """Process-wide cross-encoder: weights are loaded once, on first use or via warmup()."""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._model: Any = None
+        self._unavailable = False
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """Return the loaded CrossEncoder, or None if sentence-transformers is not installed."""
+        if self._model is not None or self._unavailable:
+            return self._model
+        with self._lock:
+            if self._model is None and not self._unavailable:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError:
+                    self._unavailable = True
+                    return None
+                if RERANKER_THREADS > 0:
+                    import torch
+                    torch.set_num_threads(RERANKER_THREADS)
+                self._model = CrossEncoder(self.model_name)
+                logger.info("Cross-encoder loaded: %s", self.model_name)
+        return self._model
+
+    def predict(self, pairs: list[tuple[str, str]]) -> list[float]:
+        model = self.get()
+        scores = model.predict(pairs, batch_size=RERANKER_BATCH_SIZE, show_progress_bar=False)
+        return [float(s) for s in scores]
+
+
+class _MicroBatcher:
+    """
+    Merges pairs from concurrent rerank calls into a single predict(): a worker thread takes the
+    first waiting request and everything already queued behind it, scores them in one pass and
+    hands each caller its slice of the scores. A lone request is dispatched at once; the
+    max_wait_s window for stragglers opens only when other requests are already queued
+    (requests arriving during a predict() are queued and batched on the next pass anyway).
+    """
+
+    def __init__(self, holder: _CrossEncoderHolder, max_wait_s: float, max_pairs: int):
+        self._holder = holder
+        self._max_wait_s = max_wait_s
+        self._max_pairs = max(1, max_pairs)
+        self._queue: queue.Queue[tuple[list[tuple[str, str]], Future]] = queue.Queue()
+        self._worker: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def score(self, pairs: list[tuple[str, str]]) -> list[float]:
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="rerank-batcher", daemon=True)
+                    self._worker.start()
+        fut: Future = Future()
+        self._queue.put((pairs, fut))
+        return fut.result()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            n_pairs = len(batch[0][0])
+            # Окно ожидания — только при конкуренции; одиночный запрос не ждёт
+            concurrent = not self._queue.empty()
+            deadline = time.monotonic() + self._max_wait_s
+            while n_pairs < self._max_pairs:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.monotonic()
+                    if not concurrent or timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                batch.append(item)
+                n_pairs += len(item[0])
+            all_pairs = [p for pairs, _ in batch for p in pairs]
+            try:
+                scores = self._holder.predict(all_pairs)
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            pos = 0
+            for pairs, fut in batch:
+                fut.set_result(scores[pos : pos + len(pairs)])
+                pos += len(pairs)
+
+
+_cross_encoder = _CrossEncoderHolder(RERANKER_MODEL)
+_batcher = _MicroBatcher(_cross_encoder, RERANKER_MICROBATCH_WAIT_MS / 1000.0, RERANKER_MICROBATCH_MAX_PAIRS)
+
+
+def warmup() -> bool:
+    """Load the local cross-encoder ahead of the first query. Returns False if it is not available."""
+    if RERANK_API_URL:
+        return False
+    return _cross_encoder.get() is not None
+
+
+@timed("rerank")
 def rerank(
     query: str,
     candidates: list[dict[str, Any]],
@@ -22,6 +144,20 @@ def rerank(
     return _rerank_local(query, candidates, top_k)
 
 
+async def arerank(
+    query: str,
+    candidates: list[dict[str, Any]],
+    top_k: int,
+) -> list[dict[str, Any]]:
+    """Async rerank(): the HTTP call or cross-encoder runs in the bounded executor."""
+    if not candidates:
+        return []
+    if len(candidates) <= top_k and not RERANK_API_URL:
+        return candidates[:top_k]
+    async with stage_slot("rerank"):
+        return await run_blocking(rerank, query, candidates, top_k)
+
+
 def _rerank_api(
     query: str, candidates: list[dict[str, Any]], top_k: int
 ) -> list[dict[str, Any]]:
@@ -76,14 +212,14 @@ def _rerank_api(
 def _rerank_local(
     query: str, candidates: list[dict[str, Any]], top_k: int
 ) -> list[dict[str, Any]]:
-    """Rerank using sentence-transformers cross-encoder."""
-    try:
-        from sentence_transformers import CrossEncoder
-    except ImportError:
+    """Rerank using the shared sentence-transformers cross-encoder (micro-batched across queries)."""
+    if _cross_encoder.get() is None:
         return candidates[:top_k]
-    model = CrossEncoder(RERANKER_MODEL)
     pairs = [(query, c.get("text", "")) for c in candidates]
-    scores = model.predict(pairs)
+    if RERANKER_MICROBATCH_WAIT_MS > 0:
+        scores = _batcher.score(pairs)
+    else:
+        scores = _cross_encoder.predict(pairs)
     indexed = [(i, float(s)) for i, s in enumerate(scores)]
     indexed.sort(key=lambda x: -x[1])
     out = []
@@ -1,49 +1,336 @@
 """Load vector index and search for relevant chunks. Supports hybrid (BM25+vector) and RRF."""
-import re
+import asyncio
 import json
+import logging
+import threading
+import weakref
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
 import numpy as np
-from openai import OpenAI
 
 try:
     import faiss
 except ImportError:
     faiss = None
 
-try:
-    from rank_bm25 import BM25Okapi
-except ImportError:
-    BM25Okapi = None
-
 from app.config import (
+    ADAPTIVE_FETCH_K_START,
+    EMBEDDING_BATCH_SIZE,
+    EXPANSION_SKIP_GAP,
+    EXPANSION_SKIP_SCORE,
+    FAISS_EF_SEARCH,
+    FAISS_MMAP,
+    FAISS_NPROBE,
     HYBRID_FETCH_K,
     HYBRID_SEARCH_ENABLED,
     INDEX_PATH,
+    INDEX_RELOAD_INTERVAL,
     MIN_RELEVANCE_SCORE,
     OPENAI_API_BASE,
     OPENAI_API_KEY,
-    OPENAI_EMBEDDING_MODEL,
     QUERY_EXPANSION_ENABLED,
     QUERY_EXPANSION_VARIANTS,
     RERANKER_ENABLED,
     RERANKER_TOP_N,
+    RERANK_SKIP_GAP,
+    RERANK_SKIP_SCORE,
     TOP_K,
 )
+from app.rag.ann_index import apply_search_params, filtered_search_params
+from app.rag.bm25 import BM25Index, bm25_exists
+from app.rag.chunk_store import LEGACY_METADATA_FILE, MANIFEST_FILE, ChunkStore, open_chunk_store, store_exists
+from app.rag.embeddings import EmbeddingProvider, check_index_embedding, get_embedding_provider
+from app.rag.filters import SearchFilter, configured_filters
+from app.rag.generations import generation_path, read_current
+from app.metrics import ADAPTIVE_DECISIONS, count_cache, observe_candidates, timed
+from app.rag.concurrency import get_executor, run_blocking, stage_slot
+from app.rag.embedding_cache import get_embedding_cache
 from app.rag.text_cleaning import normalize_for_embedding
 from app.rag.rrf import rrf_merge, RRF_K
 
+logger = logging.getLogger(__name__)
+
+# Resolved filters kept per generation (filters come from CHAT_FILTERS, so usually a handful)
+_FILTER_CACHE_SIZE = 64
+
+
+def _cached_embeddings(
+    texts: list[str], model: str
+) -> tuple[list[str], list[np.ndarray | None], list[int]]:
+    """Normalize texts and fill vectors from the in-memory embedding cache; returns (normalized, vectors, missing positions)."""
+    normalized = [normalize_for_embedding(t) for t in texts]
+    cache = get_embedding_cache()
+    vectors: list[np.ndarray | None] = [None] * len(texts)
+    if cache is not None:
+        for i, t in enumerate(normalized):
+            vectors[i] = cache.get_memory(model, t)
+    return normalized, vectors, [i for i, v in enumerate(vectors) if v is None]
+
+
+def _disk_embeddings(normalized: list[str], vectors: list[np.ndarray | None], missing: list[int], model: str) -> list[int]:
+    """Look up memory misses in the SQLite tier (blocking); returns positions still missing and counts the lookup."""
+    cache = get_embedding_cache()
+    if cache is None:
+        return missing
+    for i in missing:
+        vectors[i] = cache.get_disk(model, normalized[i])
+    still = [i for i in missing if vectors[i] is None]
+    count_cache("embedding", len(vectors) - len(still), len(still))
+    return still
+
+
+def _fill_embeddings(
+    normalized: list[str], vectors: list[np.ndarray | None], missing: list[int], data: list[np.ndarray], model: str
+) -> np.ndarray:
+    cache = get_embedding_cache()
+    for i, vec in zip(missing, data):
+        vec = np.asarray(vec, dtype=np.float32)
+        vectors[i] = cache.put(model, normalized[i], vec) if cache is not None else vec
+    return np.vstack(vectors)
+
+
+def _get_embeddings(embedder: EmbeddingProvider, texts: list[str]) -> np.ndarray:
+    """Embed texts in as few calls as possible (EMBEDDING_BATCH_SIZE per call); cached texts are not sent."""
+    normalized, vectors, missing = _cached_embeddings(texts, embedder.model_id)
+    missing = _disk_embeddings(normalized, vectors, missing, embedder.model_id)
+    data: list[np.ndarray] = []
+    if missing:
+        with timed("embed"):
+            for i in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+                batch = [normalized[j] for j in missing[i : i + EMBEDDING_BATCH_SIZE]]
+                data.extend(embedder.embed(batch))
+    return _fill_embeddings(normalized, vectors, missing, data, embedder.model_id)
+
+
+async def _aget_embeddings(embedder: EmbeddingProvider, texts: list[str]) -> np.ndarray:
+    normalized, vectors, missing = _cached_embeddings(texts, embedder.model_id)
+    cache = get_embedding_cache()
+    if missing and cache is not None and cache.has_disk:
+        # SQLite read off the event loop
+        missing = await run_blocking(_disk_embeddings, normalized, vectors, missing, embedder.model_id)
+    else:
+        missing = _disk_embeddings(normalized, vectors, missing, embedder.model_id)
+    data: list[np.ndarray] = []
+    if missing:
+        async with stage_slot("embed"):
+            with timed("embed"):
+                for i in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+                    batch = [normalized[j] for j in missing[i : i + EMBEDDING_BATCH_SIZE]]
+                    data.extend(await embedder.aembed(batch))
+    return _fill_embeddings(normalized, vectors, missing, data, embedder.model_id)
+
+
+def _expand_query(query: str) -> list[str]:
+    try:
+        from app.rag.query_expansion import expand_query_multi
+        return expand_query_multi(query, num_variants=QUERY_EXPANSION_VARIANTS)
+    except Exception:
+        logger.exception("Query expansion failed")
+        return [query]
+
+
+async def _aexpand_query(query: str) -> list[str]:
+    try:
+        from app.rag.query_expansion import aexpand_query_multi
+        async with stage_slot("generate"):
+            return await aexpand_query_multi(query, num_variants=QUERY_EXPANSION_VARIANTS)
+    except Exception:
+        logger.exception("Query expansion failed")
+        return [query]
+
+
+def _id_mapping(ids: np.ndarray) -> np.ndarray | None:
+    """Lookup table from stable chunk ids (incremental builds) to metadata positions."""
+    if len(ids) == 0 or np.array_equal(ids, np.arange(len(ids))):
+        return None
+    table = np.full(int(ids.max()) + 1, -1, dtype=np.int64)
+    table[ids] = np.arange(len(ids))
+    return table
+
+
+def _read_faiss_index(index_file: Path) -> Any:
+    """Memory-map the index when FAISS_MMAP is on (shared pages across workers), else read it into RAM."""
+    if FAISS_MMAP:
+        try:
+            return faiss.read_index(str(index_file), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            logger.info("Index type does not support mmap, reading %s into memory", index_file)
+    return faiss.read_index(str(index_file))
+
+
+_NO_IDS = np.empty(0, dtype=np.int64)
+_NO_SCORES = np.empty(0, dtype=np.float64)
+
+
+@dataclass(frozen=True)
+class _Ranked:
+    """
+    Candidates of one query as parallel arrays, best first: chunk positions in metadata and scores
+    (cosine, BM25 or RRF). vector_scores are the cosine similarities of the query's own vector hits,
+    kept through fusion for the adaptive policy. Texts are read from the chunk store only for the
+    final top-k (_materialize).
+    """
+
+    ids: np.ndarray = field(default_factory=lambda: _NO_IDS)
+    scores: np.ndarray = field(default_factory=lambda: _NO_SCORES)
+    vector_scores: np.ndarray = field(default_factory=lambda: _NO_SCORES)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def head(self, n: int) -> "_Ranked":
+        return _Ranked(self.ids[:n], self.scores[:n], self.vector_scores)
+
+
+def _materialize(gen: "IndexGeneration", ranked: _Ranked, n: int) -> list[dict[str, Any]]:
+    """First n candidates as {text, source_path, chunk_index, score}."""
+    out = []
+    for idx, score in zip(ranked.ids[:n].tolist(), ranked.scores[:n].tolist()):
+        meta = gen.metadata[idx]
+        out.append({
+            "text": meta["text"],
+            "source_path": meta["source_path"],
+            "chunk_index": meta.get("chunk_index"),
+            "score": score,
+        })
+    return out
+
+
+def _vector_signal(ranked: _Ranked) -> tuple[float, float] | None:
+    """(top vector similarity, gap to the second one); None without vector hits. FAISS returns hits best first."""
+    scores = ranked.vector_scores
+    if not len(scores):
+        return None
+    top = float(scores[0])
+    return top, top - (float(scores[1]) if len(scores) > 1 else 0.0)
+
+
+def _dominant(signal: tuple[float, float] | None, min_score: float, min_gap: float) -> bool:
+    """One clearly dominant hit: top similarity >= min_score or gap >= min_gap (0 disables a test)."""
+    if signal is None:
+        return False
+    top, gap = signal
+    return (min_score > 0 and top >= min_score) or (min_gap > 0 and gap >= min_gap)
+
+
+def _saturated(ranked: _Ranked, fetch_k: int, threshold: float) -> bool:
+    """Every fetched vector hit passes threshold, so deeper hits may pass too (FAISS returns them sorted)."""
+    return int(np.count_nonzero(ranked.vector_scores >= threshold)) >= fetch_k
+
+
+@dataclass(frozen=True)
+class _FilterMask:
+    """
+    A SearchFilter resolved against one generation: bool per chunk position (BM25 masking, fetch_k)
+    and an IDSelectorBitmap over the FAISS ids of those chunks. Only the selector is shared between
+    searches: IndexIDMap::search swaps params.sel for a stack-local translated selector while it
+    runs, so every search builds its own SearchParameters (see search_params).
+    """
 
-def _tokenize(text: str) -> list[str]:
-    """Simple word tokenization for BM25 (alphanumeric + underscores)."""
-    return re.findall(r"\w+", text.lower())
+    positions: np.ndarray
+    count: int
+    bitmap: np.ndarray
+    selector: Any
 
+    def search_params(self, kind: str) -> Any:
+        return filtered_search_params(kind, FAISS_NPROBE, FAISS_EF_SEARCH, self.selector)
 
-def _get_embedding(client: OpenAI, text: str, model: str) -> list[float]:
-    normalized = normalize_for_embedding(text)
-    resp = client.embeddings.create(input=[normalized], model=model)
-    return resp.data[0].embedding
+
+def _resolve_filter(gen: "IndexGeneration", flt: SearchFilter) -> _FilterMask:
+    store = gen.metadata
+    positions = flt.source_mask(store.sources, store.source_tags)[np.asarray(store.source_ids)]
+    ids = np.asarray(store.ids)
+    bits = np.zeros(int(ids.max()) + 1 if len(ids) else 0, dtype=bool)
+    bits[ids[positions]] = True
+    bitmap = np.packbits(bits, bitorder="little")
+    selector = faiss.IDSelectorBitmap(bitmap)
+    return _FilterMask(positions, int(np.count_nonzero(positions)), bitmap, selector)
+
+
+class IndexGeneration:
+    """
+    One loaded index build: FAISS index, chunk store, BM25 and the id mapping.
+    A search takes the current generation once and uses it to the end, so swapping in a new
+    build never mixes two of them; the old one is freed when its last search finishes.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        name: str | None,
+        index: Any,
+        metadata: ChunkStore | list[dict[str, Any]],
+        bm25: BM25Index | None,
+    ):
+        self.path = path
+        self.name = name
+        self.index = index
+        self.metadata = metadata
+        self.bm25 = bm25
+        self.kind = apply_search_params(index, FAISS_NPROBE, FAISS_EF_SEARCH)
+        if name:
+            self.version = name
+        else:
+            st = (path / "index.faiss").stat()
+            self.version = f"{st.st_mtime_ns}-{st.st_size}"
+        # FAISS id -> position in metadata; None when ids are positions (full builds, legacy indexes)
+        self.id_to_pos = _id_mapping(np.asarray(metadata.ids))
+        self._filters: dict[SearchFilter, _FilterMask] = {}
+
+    def filter_mask(self, flt: SearchFilter | None) -> _FilterMask | None:
+        """flt resolved once per generation (chunk mask + FAISS IDSelector); None for no / empty filter."""
+        if not flt:
+            return None
+        mask = self._filters.get(flt)
+        if mask is None:
+            if len(self._filters) >= _FILTER_CACHE_SIZE:
+                self._filters.clear()
+            mask = self._filters[flt] = _resolve_filter(self, flt)
+        return mask
+
+
+def _open_generation(path: Path, name: str | None, embedder: EmbeddingProvider, hybrid: bool) -> IndexGeneration:
+    index_file = path / "index.faiss"
+    meta_file = path / LEGACY_METADATA_FILE
+    if not index_file.is_file() or not (store_exists(path) or meta_file.is_file()):
+        raise FileNotFoundError(
+            f"Index not found at {path}. Run index builder first."
+        )
+    index = _read_faiss_index(index_file)
+    metadata = open_chunk_store(path)
+    _check_manifest(path, embedder, index.d)
+    bm25 = _load_bm25(path, metadata) if hybrid else None
+    gen = IndexGeneration(path, name, index, metadata, bm25)
+    for flt in configured_filters():
+        gen.filter_mask(flt)
+    if name:
+        weakref.finalize(gen, logger.info, "Index generation %s released", name).atexit = False
+    return gen
+
+
+def _check_manifest(path: Path, embedder: EmbeddingProvider, index_dim: int) -> None:
+    """Refuse to serve an index built with another embedding model (manifest.json of the builder)."""
+    manifest_file = path / MANIFEST_FILE
+    if not manifest_file.is_file():
+        return
+    try:
+        manifest = json.loads(manifest_file.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        logger.warning("Cannot read %s, skipping the embedding model check", manifest_file)
+        return
+    check_index_embedding(manifest, embedder, index_dim)
+
+
+def _load_bm25(path: Path, metadata: ChunkStore | list[dict[str, Any]]) -> BM25Index:
+    """Memory-map the BM25 index saved by the builder; build it in memory for older indexes."""
+    if bm25_exists(path):
+        bm25 = BM25Index.load(path)
+        if bm25.n_docs == len(metadata):
+            return bm25
+    logger.info("No up-to-date BM25 index in %s, building it from chunk texts", path)
+    return BM25Index.build(metadata.texts())
 
 
 class RAGRetriever:
@@ -55,143 +342,451 @@ class RAGRetriever:
         openai_api_key: str | None = None,
         openai_api_base: str | None = None,
         embedding_model: str | None = None,
+        hybrid: bool | None = None,
+        query_expansion: bool | None = None,
+        reranker: bool | None = None,
+        embedder: EmbeddingProvider | None = None,
     ):
+        """
+        hybrid / query_expansion / reranker override the config flags for this instance (None = config).
+        embedder replaces the provider from EMBEDDING_PROVIDER (embedding_model overrides only its model name).
+        """
         self.index_path = (index_path or INDEX_PATH).resolve()
         self.api_key = openai_api_key or OPENAI_API_KEY
         self.api_base = openai_api_base or OPENAI_API_BASE
-        self.embedding_model = embedding_model or OPENAI_EMBEDDING_MODEL
-        self._index: Any = None
-        self._metadata: list[dict[str, Any]] = []
-        self._client: OpenAI | None = None
-        self._bm25: Any = None
+        self.embedding_model = embedding_model
+        self.hybrid = HYBRID_SEARCH_ENABLED if hybrid is None else hybrid
+        self.query_expansion = QUERY_EXPANSION_ENABLED if query_expansion is None else query_expansion
+        self.reranker = RERANKER_ENABLED if reranker is None else reranker
+        self._embedder: EmbeddingProvider | None = embedder
+        self._gen: IndexGeneration | None = None
+        self._reload_lock = threading.Lock()
+        self._failed_generation: str | None = None
 
     def load(self) -> None:
+        """Open the current generation (INDEX_PATH/current) or the legacy layout directly in index_path."""
         if faiss is None:
             raise RuntimeError("faiss-cpu is required. Install: pip install faiss-cpu")
-        index_file = self.index_path / "index.faiss"
-        meta_file = self.index_path / "metadata.json"
-        if not index_file.is_file() or not meta_file.is_file():
-            raise FileNotFoundError(
-                f"Index not found at {self.index_path}. Run index builder first."
+        if self._embedder is None:
+            self._embedder = get_embedding_provider(self.api_key, self.api_base, self.embedding_model)
+        name = read_current(self.index_path)
+        self._gen = _open_generation(generation_path(self.index_path, name), name, self._embedder, self.hybrid)
+
+    def reload(self) -> bool:
+        """
+        Load the generation published by the builder if it differs from the served one and swap it in.
+        Searches already running finish on the old generation. Returns True when swapped.
+        """
+        with self._reload_lock:
+            name = read_current(self.index_path)
+            if name is None or self._gen is None or name == self._gen.name:
+                return False
+            try:
+                gen = _open_generation(generation_path(self.index_path, name), name, self._embedder, self.hybrid)
+            except Exception:
+                self._failed_generation = name
+                raise
+            old, self._gen = self._gen, gen
+            logger.info(
+                "Switched to index generation %s (%d chunks), was %s", name, len(gen.metadata), old.name or old.version
             )
-        self._index = faiss.read_index(str(index_file))
-        self._metadata = json.loads(meta_file.read_text(encoding="utf-8"))["chunks"]
-        self._client = OpenAI(api_key=self.api_key, base_url=self.api_base)
-        if HYBRID_SEARCH_ENABLED and BM25Okapi is not None:
-            corpus = [c["text"] for c in self._metadata]
-            tokenized = [_tokenize(t) for t in corpus]
-            self._bm25 = BM25Okapi(tokenized)
+            return True
+
+    async def watch(self, interval: float = INDEX_RELOAD_INTERVAL) -> None:
+        """
+        Poll the current pointer every interval seconds and load a new generation in the executor
+        (FAISS, chunk store, BM25) while searches keep running on the old one.
+        A generation that fails to load is not retried until the pointer changes again.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            name = read_current(self.index_path)
+            if name is None or self._gen is None or name in (self._gen.name, self._failed_generation):
+                continue
+            try:
+                await run_blocking(self.reload)
+            except Exception:
+                logger.exception("Cannot load index generation %s, still serving %s", name, self._gen.version)
+
+    def _current(self) -> IndexGeneration:
+        if self._gen is None or self._embedder is None:
+            self.load()
+        return self._gen
+
+    async def _acurrent(self) -> IndexGeneration:
+        if self._gen is None or self._embedder is None:
+            await run_blocking(self.load)
+        return self._gen
+
+    @property
+    def index_kind(self) -> str | None:
+        return self._gen.kind if self._gen is not None else None
+
+    @property
+    def index_version(self) -> str | None:
+        """Identifier of the served index build; changes when a new generation is swapped in."""
+        return self._gen.version if self._gen is not None else None
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """L2-normalized query embedding (served from the embedding cache after a search)."""
+        if self._embedder is None:
+            self.load()
+        qv = _get_embeddings(self._embedder, [query]).copy()
+        faiss.normalize_L2(qv)
+        return qv[0]
+
+    async def aembed_query(self, query: str) -> np.ndarray:
+        if self._embedder is None:
+            await run_blocking(self.load)
+        qv = (await _aget_embeddings(self._embedder, [query])).copy()
+        faiss.normalize_L2(qv)
+        return qv[0]
 
+    def _hybrid_active(self, gen: IndexGeneration) -> bool:
+        return self.hybrid and gen.bm25 is not None
+
+    @timed("faiss")
     def _vector_candidates(
-        self, query: str, fetch_k: int, min_score: float | None = None
-    ) -> list[dict[str, Any]]:
-        """Return list of {chunk_id, text, source_path, score} from vector search."""
-        q = _get_embedding(self._client, query, self.embedding_model)
-        qv = np.array([q], dtype=np.float32)
+        self,
+        gen: IndexGeneration,
+        qmat: np.ndarray,
+        fetch_k: int,
+        min_score: float | None = None,
+        mask: _FilterMask | None = None,
+    ) -> list[_Ranked]:
+        """
+        One multi-row FAISS search for already computed query embeddings (CPU-bound); one _Ranked per query.
+        With mask, FAISS skips excluded ids during the search itself (IDSelector).
+        """
+        qv = np.array(qmat, dtype=np.float32)
         faiss.normalize_L2(qv)
-        scores, indices = self._index.search(qv, fetch_k)
+        if mask is not None:
+            scores, indices = gen.index.search(qv, fetch_k, params=mask.search_params(gen.kind))
+        else:
+            scores, indices = gen.index.search(qv, fetch_k)
+        if gen.id_to_pos is not None:
+            indices = np.where(indices >= 0, gen.id_to_pos[np.maximum(indices, 0)], -1)
+        # float64: порог сравнивается так же, как раньше с float(score)
+        scores = scores.astype(np.float64)
         threshold = min_score if min_score is not None else MIN_RELEVANCE_SCORE
-        out = []
-        for score, idx in zip(scores[0], indices[0]):
-            if idx < 0 or (threshold > 0 and float(score) < threshold):
-                continue
-            meta = self._metadata[idx]
-            out.append({
-                "chunk_id": int(idx),
-                "text": meta["text"],
-                "source_path": meta["source_path"],
-                "score": float(score),
-            })
-        return out
-
-    def _bm25_candidates(self, query: str, fetch_k: int) -> list[dict[str, Any]]:
-        """Return list of {chunk_id, text, source_path, score} from BM25 (score = BM25 score)."""
-        if self._bm25 is None or not self._metadata:
-            return []
-        q_tokens = _tokenize(query)
-        if not q_tokens:
-            return []
-        scores = self._bm25.get_scores(q_tokens)
-        top_indices = np.argsort(scores)[::-1][:fetch_k]
-        out = []
-        for idx in top_indices:
-            if scores[idx] <= 0:
-                continue
-            meta = self._metadata[idx]
-            out.append({
-                "chunk_id": int(idx),
-                "text": meta["text"],
-                "source_path": meta["source_path"],
-                "score": float(scores[idx]),
-            })
-        return out
-
-    def _retrieve_one_query(
-        self, query: str, fetch_k: int, min_score: float | None = None
-    ) -> list[dict[str, Any]]:
-        """Single-query retrieval: vector only or hybrid (vector + BM25 + RRF). Returns list with chunk_id."""
-        if HYBRID_SEARCH_ENABLED and self._bm25 is not None:
-            vec_list = self._vector_candidates(query, fetch_k, min_score=None)
-            bm25_list = self._bm25_candidates(query, fetch_k)
-            if not vec_list and not bm25_list:
-                return []
-            if not vec_list:
-                return bm25_list[:fetch_k]
-            if not bm25_list:
-                return vec_list[:fetch_k]
-            merged = rrf_merge([vec_list, bm25_list], self._metadata, k=RRF_K)
-            return merged
+        lists = []
+        for row_scores, row_indices in zip(scores, indices):
+            keep = row_indices >= 0
+            if threshold > 0:
+                keep &= row_scores >= threshold
+            row_scores = row_scores[keep]
+            lists.append(_Ranked(row_indices[keep].astype(np.int64), row_scores, row_scores))
+            observe_candidates("vector", len(row_scores))
+        return lists
+
+    @timed("bm25")
+    def _bm25_lists(
+        self, gen: IndexGeneration, queries: list[str], fetch_k: int, mask: _FilterMask | None = None
+    ) -> list[_Ranked]:
+        """BM25 candidates for several queries, scored in one vectorized pass (postings outside mask skipped)."""
+        if gen.bm25 is None or not gen.metadata:
+            return [_Ranked() for _ in queries]
+        lists = []
+        positions = mask.positions if mask is not None else None
+        for top_indices, scores in gen.bm25.top_k_batch(queries, fetch_k, positions):
+            lists.append(_Ranked(top_indices.astype(np.int64), scores.astype(np.float64)))
+            observe_candidates("bm25", len(top_indices))
+        return lists
+
+    @timed("rrf")
+    def _fuse_hybrid(self, gen: IndexGeneration, vec: _Ranked, bm25: _Ranked, fetch_k: int) -> _Ranked:
+        if not len(vec):
+            return bm25.head(fetch_k)
+        if not len(bm25):
+            return vec.head(fetch_k)
+        ids, scores = rrf_merge([vec.ids, bm25.ids], k=RRF_K)
+        return _Ranked(ids, scores, vec.vector_scores)
+
+    def _retrieve(
+        self,
+        gen: IndexGeneration,
+        queries: list[str],
+        fetch_k: int,
+        min_score: float | None = None,
+        qmat: np.ndarray | None = None,
+        mask: _FilterMask | None = None,
+    ) -> list[_Ranked]:
+        """
+        Retrieval for several queries at once: one embeddings request, one multi-row FAISS search,
+        plus BM25 and RRF per query in hybrid mode. Returns one _Ranked per query.
+        qmat: embeddings computed earlier (adaptive fetch_k searches again with the same vectors).
+        mask: metadata filter applied inside FAISS and BM25.
+        """
+        if qmat is None:
+            qmat = _get_embeddings(self._embedder, queries)
+        if self._hybrid_active(gen):
+            vec_lists = self._vector_candidates(gen, qmat, fetch_k, None, mask)
+            bm25_lists = self._bm25_lists(gen, queries, fetch_k, mask)
+            return [self._fuse_hybrid(gen, v, b, fetch_k) for v, b in zip(vec_lists, bm25_lists)]
         # Vector only (original behaviour)
-        return self._vector_candidates(query, fetch_k, min_score)
+        return self._vector_candidates(gen, qmat, fetch_k, min_score, mask)
 
+    async def _aretrieve(
+        self,
+        gen: IndexGeneration,
+        queries: list[str],
+        fetch_k: int,
+        min_score: float | None = None,
+        qmat: np.ndarray | None = None,
+        mask: _FilterMask | None = None,
+    ) -> list[_Ranked]:
+        """Async _retrieve: BM25 runs in the executor while the embeddings request is in flight."""
+        if self._hybrid_active(gen):
+            bm25_task = asyncio.ensure_future(self._run_retrieve(self._bm25_lists, gen, queries, fetch_k, mask))
+            if qmat is None:
+                qmat = await _aget_embeddings(self._embedder, queries)
+            vec_lists = await self._run_retrieve(self._vector_candidates, gen, qmat, fetch_k, None, mask)
+            bm25_lists = await bm25_task
+            return [self._fuse_hybrid(gen, v, b, fetch_k) for v, b in zip(vec_lists, bm25_lists)]
+        if qmat is None:
+            qmat = await _aget_embeddings(self._embedder, queries)
+        return await self._run_retrieve(self._vector_candidates, gen, qmat, fetch_k, min_score, mask)
+
+    @staticmethod
+    async def _run_retrieve(func, *args):
+        async with stage_slot("retrieve"):
+            return await run_blocking(func, *args)
+
+    def _fetch_k(self, gen: IndexGeneration, k: int, mask: _FilterMask | None = None) -> int:
+        available = mask.count if mask is not None else len(gen.metadata)
+        fetch_k = HYBRID_FETCH_K if self.hybrid else min(k * 3, available)
+        return fetch_k
+
+    @staticmethod
+    def _adaptive_start(fetch_k: int, threshold: float) -> int | None:
+        """
+        First fetch_k of the adaptive policy, or None when it is off. Without a relevance threshold
+        every hit passes and the policy would always grow to fetch_k, so it needs threshold > 0.
+        """
+        if ADAPTIVE_FETCH_K_START <= 0 or threshold <= 0 or ADAPTIVE_FETCH_K_START >= fetch_k:
+            return None
+        return ADAPTIVE_FETCH_K_START
+
+    @staticmethod
+    def _grow(current: int, fetch_k: int, ranked: _Ranked, threshold: float) -> int | None:
+        """Next fetch_k when every fetched hit passed threshold and the cap is not reached, else None."""
+        if current >= fetch_k or not _saturated(ranked, current, threshold):
+            return None
+        grown = min(current * 2, fetch_k)
+        logger.info("Adaptive retrieval: all %d hits pass %.3f, fetch_k %d -> %d", current, threshold, current, grown)
+        ADAPTIVE_DECISIONS.inc(decision="fetch_k_grown")
+        return grown
+
+    def _retrieve_adaptive(
+        self,
+        gen: IndexGeneration,
+        query: str,
+        fetch_k: int,
+        threshold: float,
+        min_score: float | None,
+        mask: _FilterMask | None = None,
+    ) -> tuple[_Ranked, int]:
+        """
+        _retrieve for one query with adaptive depth: start at ADAPTIVE_FETCH_K_START and double while
+        all hits pass threshold, up to fetch_k; the query is embedded once.
+        Returns (candidates, fetch_k used).
+        """
+        current = self._adaptive_start(fetch_k, threshold)
+        if current is None:
+            return self._retrieve(gen, [query], fetch_k, min_score, mask=mask)[0], fetch_k
+        qmat = _get_embeddings(self._embedder, [query])
+        while True:
+            items = self._retrieve(gen, [query], current, min_score, qmat=qmat, mask=mask)[0]
+            grown = self._grow(current, fetch_k, items, threshold)
+            if grown is None:
+                return items, current
+            current = grown
+
+    async def _aretrieve_adaptive(
+        self,
+        gen: IndexGeneration,
+        query: str,
+        fetch_k: int,
+        threshold: float,
+        min_score: float | None,
+        mask: _FilterMask | None = None,
+    ) -> tuple[_Ranked, int]:
+        current = self._adaptive_start(fetch_k, threshold)
+        if current is None:
+            return (await self._aretrieve(gen, [query], fetch_k, min_score, mask=mask))[0], fetch_k
+        qmat = await _aget_embeddings(self._embedder, [query])
+        while True:
+            items = (await self._aretrieve(gen, [query], current, min_score, qmat=qmat, mask=mask))[0]
+            grown = self._grow(current, fetch_k, items, threshold)
+            if grown is None:
+                return items, current
+            current = grown
+
+    @staticmethod
+    def _skip_expansion(signal: tuple[float, float] | None, expansion: Any) -> bool:
+        """
+        Drop the in-flight expansion for a dominant hit. A job that is already running cannot be
+        stopped (an executor future; an asyncio task is cancelled mid-request): then the LLM call
+        is paid anyway and only the search of its variants is saved, counted as expansion_unused.
+        """
+        if not _dominant(signal, EXPANSION_SKIP_SCORE, EXPANSION_SKIP_GAP):
+            return False
+        decision = "expansion_skipped" if expansion.cancel() else "expansion_unused"
+        logger.info("Adaptive retrieval: %s (top %.3f, gap %.3f)", decision, *signal)
+        ADAPTIVE_DECISIONS.inc(decision=decision)
+        return True
+
+    def _skip_rerank(self, signal: tuple[float, float] | None) -> bool:
+        if not self.reranker or not _dominant(signal, RERANK_SKIP_SCORE, RERANK_SKIP_GAP):
+            return False
+        logger.info("Adaptive retrieval: reranker skipped (top %.3f, gap %.3f)", *signal)
+        ADAPTIVE_DECISIONS.inc(decision="rerank_skipped")
+        return True
+
+    @timed("rrf")
+    def _fuse_expanded(self, gen: IndexGeneration, ranked_lists: list[_Ranked]) -> _Ranked:
+        """RRF over the ranked lists of expanded queries."""
+        ids, scores = rrf_merge([r.ids for r in ranked_lists], k=RRF_K)
+        return _Ranked(ids, scores)
+
+    @timed("search")
     def search(
         self,
         query: str,
         top_k: int | None = None,
         min_score: float | None = None,
+        search_filter: SearchFilter | None = None,
     ) -> list[dict[str, Any]]:
         """
-        Return list of {text, source_path, score} for top_k nearest chunks.
+        Return list of {text, source_path, chunk_index, score} for top_k nearest chunks.
         Uses query expansion, hybrid search, and reranker when enabled in config.
+        The adaptive policy (ADAPTIVE_FETCH_K_START, *_SKIP_SCORE / *_SKIP_GAP) can fetch fewer
+        candidates and skip expansion or reranking when the original query has a dominant hit.
+        search_filter restricts the search to source path prefixes / tags (inside FAISS and BM25).
         """
         k = top_k if top_k is not None else TOP_K
         threshold = min_score if min_score is not None else MIN_RELEVANCE_SCORE
-        if self._index is None or self._client is None:
-            self.load()
-        fetch_k = HYBRID_FETCH_K if HYBRID_SEARCH_ENABLED else min(k * 3, len(self._metadata))
-        if threshold > 0 and not HYBRID_SEARCH_ENABLED:
-            fetch_k = min(fetch_k, len(self._metadata))
+        gen = self._current()
+        mask = gen.filter_mask(search_filter)
+        if mask is not None and not mask.count:
+            return []
+        fetch_k = self._fetch_k(gen, k, mask)
 
-        if QUERY_EXPANSION_ENABLED:
-            try:
-                from app.rag.query_expansion import expand_query_multi
-                queries = expand_query_multi(query, num_variants=QUERY_EXPANSION_VARIANTS)
-            except Exception:
-                queries = [query]
-            ranked_lists = []
-            for q in queries:
-                one = self._retrieve_one_query(q, fetch_k, min_score=None)
-                ranked_lists.append(one)
-            if not ranked_lists or all(not r for r in ranked_lists):
-                return []
-            # RRF over expanded queries
-            merged = rrf_merge(ranked_lists, self._metadata, k=RRF_K)
-            candidates = [{"text": c["text"], "source_path": c["source_path"], "score": c["score"]} for c in merged]
+        if self.query_expansion:
+            # The original query is retrieved while the LLM writes reformulations;
+            # the reformulations are then embedded and searched as one batch.
+            expansion = get_executor().submit(_expand_query, query)
+            original, fetch_k = self._retrieve_adaptive(gen, query, fetch_k, threshold, None, mask)
+            signal = _vector_signal(original)
+            if self._skip_expansion(signal, expansion):
+                variants = []
+            else:
+                variants = [q for q in expansion.result() if q != query]
+            ranked_lists = [original] + (self._retrieve(gen, variants, fetch_k, mask=mask) if variants else [])
+            candidates = self._fuse_expanded(gen, ranked_lists)
         else:
-            raw = self._retrieve_one_query(query, fetch_k, threshold)
-            if not raw:
-                return []
-            # _retrieve_one_query may return items with chunk_id; for single-query path we want {text, source_path, score}
-            candidates = [
-                {"text": r["text"], "source_path": r["source_path"], "score": r["score"]}
-                for r in raw
-            ]
+            original, _ = self._retrieve_adaptive(gen, query, fetch_k, threshold, threshold, mask)
+            signal = _vector_signal(original)
+            candidates = original
+        observe_candidates("fused", len(candidates))
+        return self._finish(gen, query, candidates, k, signal)
 
-        if RERANKER_ENABLED:
+    def _finish(
+        self,
+        gen: IndexGeneration,
+        query: str,
+        candidates: _Ranked,
+        k: int,
+        signal: tuple[float, float] | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Optional reranking of fused candidates (skipped for a dominant hit), then cut to k.
+        Only the chunks returned (or sent to the reranker) are read from the chunk store.
+        """
+        if not len(candidates):
+            return []
+        if self.reranker and not self._skip_rerank(signal):
             from app.rag.reranker import rerank
             n = min(RERANKER_TOP_N, len(candidates))
-            to_rerank = candidates[:n]
-            candidates = rerank(query, to_rerank, top_k=k)
-            return candidates[:k]
+            return rerank(query, _materialize(gen, candidates, n), top_k=k)[:k]
+        return _materialize(gen, candidates, k)
+
+    def search_batch(
+        self,
+        queries: list[str],
+        top_k: int | None = None,
+        min_score: float | None = None,
+        search_filter: SearchFilter | None = None,
+    ) -> list[list[dict[str, Any]]]:
+        """
+        search() for many queries at once (offline evaluation, replaying query logs).
+        Queries are embedded in bulk, searched with one matrix FAISS call and scored by BM25 in
+        one vectorized pass; RRF and reranking are applied per query. Results align with queries.
+        """
+        k = top_k if top_k is not None else TOP_K
+        threshold = min_score if min_score is not None else MIN_RELEVANCE_SCORE
+        gen = self._current()
+        queries = list(queries)
+        if not queries:
+            return []
+        mask = gen.filter_mask(search_filter)
+        if mask is not None and not mask.count:
+            return [[] for _ in queries]
+        fetch_k = self._fetch_k(gen, k, mask)
+
+        if self.query_expansion:
+            expanded = list(get_executor().map(_expand_query, queries))
+            lists = self._retrieve(gen, [q for qs in expanded for q in qs], fetch_k, mask=mask)
+            per_query = []
+            pos = 0
+            for qs in expanded:
+                per_query.append(self._fuse_expanded(gen, lists[pos : pos + len(qs)]))
+                pos += len(qs)
+        else:
+            per_query = self._retrieve(gen, queries, fetch_k, threshold, mask=mask)
+        return [self._finish(gen, q, c, k) for q, c in zip(queries, per_query)]
+
+    async def asearch(
+        self,
+        query: str,
+        top_k: int | None = None,
+        min_score: float | None = None,
+        search_filter: SearchFilter | None = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Async search(): network calls are awaited, FAISS/BM25/cross-encoder run in the bounded
+        executor, so concurrent chats overlap instead of blocking the event loop.
+        """
+        with timed("search"):
+            k = top_k if top_k is not None else TOP_K
+            threshold = min_score if min_score is not None else MIN_RELEVANCE_SCORE
+            gen = await self._acurrent()
+            mask = gen.filter_mask(search_filter)
+            if mask is not None and not mask.count:
+                return []
+            fetch_k = self._fetch_k(gen, k, mask)
+
+            if self.query_expansion:
+                expansion = asyncio.create_task(_aexpand_query(query))
+                original, fetch_k = await self._aretrieve_adaptive(gen, query, fetch_k, threshold, None, mask)
+                signal = _vector_signal(original)
+                if self._skip_expansion(signal, expansion):
+                    variants = []
+                else:
+                    variants = [q for q in await expansion if q != query]
+                ranked_lists = [original] + (await self._aretrieve(gen, variants, fetch_k, mask=mask) if variants else [])
+                candidates = self._fuse_expanded(gen, ranked_lists)
+            else:
+                original, _ = await self._aretrieve_adaptive(gen, query, fetch_k, threshold, threshold, mask)
+                signal = _vector_signal(original)
+                candidates = original
+            observe_candidates("fused", len(candidates))
+            if not len(candidates):
+                return []
+
+            if self.reranker and not self._skip_rerank(signal):
+                from app.rag.reranker import arerank
+                n = min(RERANKER_TOP_N, len(candidates))
+                return (await arerank(query, _materialize(gen, candidates, n), top_k=k))[:k]
 
-        return candidates[:k]
+            return _materialize(gen, candidates, k)
@@ -1,35 +1,23 @@
 """Reciprocal Rank Fusion (RRF) for merging multiple ranked lists."""
-from typing import Any
+import numpy as np
 
 # Default RRF constant (k=60 is standard)
 RRF_K = 60
 
 
-def rrf_merge(
-    ranked_lists: list[list[dict[str, Any]]],
-    metadata: list[dict[str, Any]],
-    k: int = RRF_K,
-) -> list[dict[str, Any]]:
+def rrf_merge(ranked_ids: list[np.ndarray], k: int = RRF_K) -> tuple[np.ndarray, np.ndarray]:
     """
     Merge multiple ranked lists using Reciprocal Rank Fusion.
-    Each item in ranked_lists should be a list of dicts with "chunk_id" (index into metadata).
-    Returns list of {text, source_path, score} sorted by RRF score descending.
+    Each list is an array of chunk ids (positions in metadata), best first; an id at 1-based
+    rank r gets 1 / (k + r) from that list, summed over lists by a scatter-add (bincount).
+    Returns (ids, RRF scores) sorted by score descending; ties keep the order of first appearance.
     """
-    scores: dict[int, float] = {}
-    for rank_list in ranked_lists:
-        for rank_1based, item in enumerate(rank_list, start=1):
-            cid = item.get("chunk_id", -1)
-            if cid < 0 or cid >= len(metadata):
-                continue
-            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank_1based)
-    ordered = sorted(scores.items(), key=lambda x: -x[1])
-    out = []
-    for cid, rrf_score in ordered:
-        meta = metadata[cid]
-        out.append({
-            "chunk_id": cid,
-            "text": meta["text"],
-            "source_path": meta["source_path"],
-            "score": rrf_score,
-        })
-    return out
+    lists = [np.asarray(ids, dtype=np.int64) for ids in ranked_ids if len(ids)]
+    if not lists:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    all_ids = np.concatenate(lists)
+    weights = np.concatenate([1.0 / (k + np.arange(1, len(ids) + 1, dtype=np.float64)) for ids in lists])
+    uniq, first, inverse = np.unique(all_ids, return_index=True, return_inverse=True)
+    scores = np.bincount(inverse, weights=weights, minlength=len(uniq))
+    order = np.lexsort((first, -scores))
+    return uniq[order], scores[order]
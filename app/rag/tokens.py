@@ -0,0 +1,43 @@
+"""Token counting with tiktoken; a ~4 characters per token estimate when it is unavailable."""
+import logging
+from functools import lru_cache
+from typing import Any, Callable
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=8)
+def get_encoding(model: str) -> Any:
+    """tiktoken encoding for model (cl100k_base for unknown models); None without tiktoken or its BPE files."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model.rsplit("/", 1)[-1])
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # BPE-файлы скачиваются при первом использовании; без сети — оценка по символам
+        logger.warning("tiktoken encoding unavailable for %s, estimating tokens from length", model)
+        return None
+
+
+def token_counter(model: str) -> Callable[[str], int]:
+    enc = get_encoding(model)
+    if enc is not None:
+        return lambda text: len(enc.encode(text, disallowed_special=()))
+    return lambda text: len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Prefix of text of at most max_tokens tokens."""
+    enc = get_encoding(model)
+    if enc is None:
+        return text[: max(0, max_tokens - 1) * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else enc.decode(tokens[:max_tokens])
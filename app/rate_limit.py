@@ -0,0 +1,161 @@
+"""Token-bucket rate limiting per chat / per user / globally, with in-memory or Redis state."""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+from app.config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_GLOBAL_PER_MINUTE,
+    RATE_LIMIT_IDLE_TTL,
+    RATE_LIMIT_PER_MINUTE,
+    RATE_LIMIT_USER_PER_MINUTE,
+    REDIS_URL,
+)
+
+
+@dataclass(frozen=True)
+class Bucket:
+    """One limit: bucket key, capacity (burst) and refill rate in tokens per second."""
+    key: str
+    capacity: float
+    rate: float
+
+    @property
+    def refill_seconds(self) -> float:
+        """Time for an empty bucket to refill; forgetting it sooner would hand out extra tokens."""
+        return self.capacity / self.rate
+
+
+def per_minute(key: str, limit: int) -> Bucket:
+    return Bucket(key, float(limit), limit / 60.0)
+
+
+class MemoryBackend:
+    """
+    Buckets in an OrderedDict ordered by last use: a check is O(1), and idle buckets
+    (untouched for idle_ttl seconds, but never less than their refill time) are evicted from
+    the front, so memory is bounded by the number of recently active chats, not by every chat ever seen.
+    """
+
+    def __init__(self, idle_ttl: float):
+        self._idle_ttl = idle_ttl
+        # key -> (tokens, last_ts, seconds a bucket is kept after last use)
+        self._buckets: OrderedDict[str, tuple[float, float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def acquire(self, buckets: list[Bucket]) -> bool:
+        now = time.monotonic()
+        self._evict(now)
+        levels = []
+        for b in buckets:
+            tokens, ts, _ = self._buckets.get(b.key, (b.capacity, now, 0.0))
+            tokens = min(b.capacity, tokens + (now - ts) * b.rate)
+            if tokens < 1.0:
+                return False
+            levels.append(tokens)
+        # Токен списывается только если пропускают все лимиты
+        for b, tokens in zip(buckets, levels):
+            self._buckets[b.key] = (tokens - 1.0, now, max(self._idle_ttl, b.refill_seconds))
+            self._buckets.move_to_end(b.key)
+        return True
+
+    def _evict(self, now: float) -> None:
+        while self._buckets:
+            key, (_, ts, keep) = next(iter(self._buckets.items()))
+            if now - ts < keep:
+                break
+            del self._buckets[key]
+
+
+# KEYS: bucket keys; ARGV: idle ttl (ms), then capacity/rate pairs. Все лимиты проверяются и списываются атомарно.
+# TTL ключа не меньше времени полного пополнения (capacity / rate), иначе истёкший ключ выдаст лишние токены.
+_REDIS_ACQUIRE = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1e6
+local ttl = tonumber(ARGV[1])
+local levels = {}
+for i = 1, #KEYS do
+  local cap = tonumber(ARGV[2 * i])
+  local rate = tonumber(ARGV[2 * i + 1])
+  local v = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+  local tokens = tonumber(v[1]) or cap
+  local ts = tonumber(v[2]) or now
+  tokens = math.min(cap, tokens + (now - ts) * rate)
+  if tokens < 1 then
+    return 0
+  end
+  levels[i] = tokens
+end
+for i = 1, #KEYS do
+  redis.call('HSET', KEYS[i], 'tokens', tostring(levels[i] - 1), 'ts', tostring(now))
+  local refill = math.ceil(tonumber(ARGV[2 * i]) / tonumber(ARGV[2 * i + 1]) * 1000)
+  redis.call('PEXPIRE', KEYS[i], math.max(ttl, refill))
+end
+return 1
+"""
+
+
+class RedisBackend:
+    """Shared buckets in Redis, so several bot replicas enforce one limit. Idle keys expire via PEXPIRE."""
+
+    def __init__(self, url: str, idle_ttl: float, prefix: str = "ratelimit:"):
+        if aioredis is None:
+            raise RuntimeError("redis is not installed. pip install redis")
+        if not url:
+            raise ValueError("REDIS_URL is not set")
+        self._redis = aioredis.from_url(url)
+        self._script = self._redis.register_script(_REDIS_ACQUIRE)
+        self._idle_ttl_ms = int(idle_ttl * 1000)
+        self._prefix = prefix
+
+    async def acquire(self, buckets: list[Bucket]) -> bool:
+        keys = [self._prefix + b.key for b in buckets]
+        args: list[float] = [self._idle_ttl_ms]
+        for b in buckets:
+            args.extend((b.capacity, b.rate))
+        return bool(await self._script(keys=keys, args=args))
+
+
+class RateLimiter:
+    """Checks a message against the per-chat, per-user and global limits (0 = limit off)."""
+
+    def __init__(self, backend, per_chat: int, per_user: int = 0, global_limit: int = 0):
+        self._backend = backend
+        self._per_chat = per_chat
+        self._per_user = per_user
+        self._global = global_limit
+
+    async def allow(self, chat_id: int, user_id: int | None = None) -> bool:
+        buckets = []
+        if self._per_chat > 0:
+            buckets.append(per_minute(f"chat:{chat_id}", self._per_chat))
+        if self._per_user > 0 and user_id is not None:
+            buckets.append(per_minute(f"user:{user_id}", self._per_user))
+        if self._global > 0:
+            buckets.append(per_minute("global", self._global))
+        if not buckets:
+            return True
+        return await self._backend.acquire(buckets)
+
+
+def make_rate_limiter() -> RateLimiter:
+    """RateLimiter from config: RATE_LIMIT_BACKEND=memory (default) or redis (REDIS_URL)."""
+    if RATE_LIMIT_BACKEND == "redis":
+        backend = RedisBackend(REDIS_URL, RATE_LIMIT_IDLE_TTL)
+    elif RATE_LIMIT_BACKEND == "memory":
+        backend = MemoryBackend(RATE_LIMIT_IDLE_TTL)
+    else:
+        raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {RATE_LIMIT_BACKEND!r} (expected memory or redis)")
+    return RateLimiter(
+        backend,
+        per_chat=RATE_LIMIT_PER_MINUTE,
+        per_user=RATE_LIMIT_USER_PER_MINUTE,
+        global_limit=RATE_LIMIT_GLOBAL_PER_MINUTE,
+    )
@@ -0,0 +1,61 @@
+"""Per-chat FIFO scheduling of bot requests with a global backlog limit (backpressure)."""
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+
+class ChatScheduler:
+    """
+    Sits between the dispatcher and the RAG pipeline. Each chat has its own FIFO queue
+    drained by one task, so a chat's messages are answered in order while different chats
+    run concurrently (global limits per stage are in app.rag.concurrency.stage_slot).
+    submit() refuses new work when the backlog is over the limit, so the bot can say
+    "queue is full" right away instead of letting requests time out.
+    """
+
+    def __init__(self, max_pending: int, max_pending_per_chat: int):
+        self._max_pending = max_pending
+        self._max_pending_per_chat = max_pending_per_chat
+        self._queues: dict[int, deque[Job]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        """Queued + running jobs across all chats."""
+        return self._pending
+
+    def submit(self, chat_id: int, job: Job) -> bool:
+        """Enqueue job for chat_id; False if the global or per-chat backlog is full."""
+        queue = self._queues.get(chat_id)
+        if self._max_pending > 0 and self._pending >= self._max_pending:
+            return False
+        if queue is not None and self._max_pending_per_chat > 0 and len(queue) >= self._max_pending_per_chat:
+            return False
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            task = asyncio.create_task(self._drain(chat_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(job)
+        self._pending += 1
+        return True
+
+    async def _drain(self, chat_id: int, queue: deque[Job]) -> None:
+        # Текущая задача остаётся в голове очереди до завершения — она учитывается в лимите чата
+        try:
+            while queue:
+                try:
+                    await queue[0]()
+                except Exception:
+                    logger.exception("Job for chat %s failed", chat_id)
+                finally:
+                    queue.popleft()
+                    self._pending -= 1
+        finally:
+            self._queues.pop(chat_id, None)
@@ -1,5 +1,6 @@
 """Convert LLM Markdown output to Telegram HTML for correct display."""
 import html
+import re
 
 
 def markdown_to_telegram_html(text: str) -> str:
@@ -27,3 +28,40 @@ def markdown_to_telegram_html(text: str) -> str:
         parts[i] = f"<code>{parts[i]}</code>"
     out = "".join(parts)
     return out
+
+
+_MARKER_TAGS = {"**": "b", "*": "i", "`": "code"}
+_MARKER_RE = re.compile(r"\*\*|\*|`")
+
+
+def markdown_to_telegram_html_partial(text: str) -> str:
+    """
+    Same conversion for a partial (still streaming) answer.
+    Tags are always balanced and properly nested: a marker whose pair has not arrived yet
+    stays open until the end of the text, and a trailing half-written marker is dropped.
+    For complete, well-formed input the result matches markdown_to_telegram_html.
+    """
+    if not text or not text.strip():
+        return text
+    # "*" в конце может оказаться началом "**" — ждём следующий кусок
+    text = text.rstrip("*`")
+    stack: list[str] = []
+    out: list[str] = []
+    pos = 0
+    for m in _MARKER_RE.finditer(text):
+        out.append(html.escape(text[pos:m.start()]))
+        pos = m.end()
+        tag = _MARKER_TAGS[m.group()]
+        if tag not in stack:
+            stack.append(tag)
+            out.append(f"<{tag}>")
+            continue
+        # Закрываем тег; теги, открытые внутри него, закрываем и открываем заново
+        inner = stack[stack.index(tag) + 1:]
+        out.extend(f"</{t}>" for t in reversed(inner))
+        out.append(f"</{tag}>")
+        out.extend(f"<{t}>" for t in inner)
+        stack.remove(tag)
+    out.append(html.escape(text[pos:]))
+    out.extend(f"</{t}>" for t in reversed(stack))
+    return "".join(out)
@@ -0,0 +1,127 @@
+"""Progressive delivery of a streaming LLM answer: one placeholder message edited as text arrives."""
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+from app.metrics import timed
+from app.utils.telegram_format import markdown_to_telegram_html, markdown_to_telegram_html_partial
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER = "…"
+# Telegram: до 4096 символов текста в сообщении; берём с запасом и режем по переносу строки
+MESSAGE_LIMIT = 4000
+# Попыток финальной правки сообщения под flood control (между ними ждём retry_after)
+FINALIZE_ATTEMPTS = 3
+FENCE = "```"
+
+
+def _open_spans(text: str) -> bool:
+    """Does text end inside a code block, inline code or bold span (odd number of markers)?"""
+    fences = text.count(FENCE)
+    if fences % 2:
+        return True
+    outside = "".join(text.split(FENCE)[::2])
+    return bool(outside.count("**") % 2 or outside.replace("**", "").count("`") % 2)
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> tuple[str, str]:
+    """
+    Split text at a line break within limit, preferring one outside code blocks and bold / inline code
+    spans. A forced cut inside a code block closes it in the head and reopens it in the tail.
+    """
+    cut = text.rfind("\n", 0, limit)
+    fallback = cut if cut > 0 else limit
+    while cut > 0 and _open_spans(text[:cut]):
+        cut = text.rfind("\n", 0, cut)
+    if cut <= 0:
+        cut = fallback
+    head, tail = text[:cut], text[cut:].lstrip("\n")
+    if head.count(FENCE) % 2:
+        head, tail = head + "\n" + FENCE, FENCE + "\n" + tail
+    return head, tail
+
+
+class StreamingReply:
+    """
+    Accumulates answer deltas and edits the reply message at most once per edit_interval
+    (Telegram throttles frequent edits of the same chat). Partial text is rendered with
+    balanced HTML; when it outgrows one message, the head is finalized and a new message continues.
+    """
+
+    def __init__(self, message: Message, edit_interval: float):
+        self._message = message
+        self._edit_interval = edit_interval
+        self._reply: Message | None = None
+        self._text = ""       # текущий сегмент (текст в self._reply)
+        self._full: list[str] = []
+        self._shown = ""
+        self._next_edit = 0.0
+
+    async def start(self) -> None:
+        self._reply = await self._message.answer(PLACEHOLDER)
+        self._next_edit = time.monotonic() + self._edit_interval
+
+    async def push(self, delta: str) -> None:
+        self._full.append(delta)
+        self._text += delta
+        while len(self._text) > MESSAGE_LIMIT:
+            head, self._text = split_message(self._text)
+            await self._finalize(head)
+            self._reply = await self._message.answer(PLACEHOLDER)
+            self._shown = ""
+        if time.monotonic() >= self._next_edit:
+            await self._render(self._text, final=False)
+
+    async def finish(self) -> str:
+        """
+        Final edit with the complete formatting; returns the whole answer text.
+        Raises TelegramRetryAfter if the final edit could not be delivered (see _finalize).
+        """
+        await self._finalize(self._text.strip() or PLACEHOLDER)
+        return "".join(self._full).strip()
+
+    async def _finalize(self, text: str) -> None:
+        """
+        Final edit of the current message; unlike _render, waits out flood control and retries.
+        If Telegram still refuses after FINALIZE_ATTEMPTS, TelegramRetryAfter is raised: the user
+        did not get the final text, so the answer must not be reported (or cached) as delivered.
+        """
+        for attempt in range(1, FINALIZE_ATTEMPTS + 1):
+            try:
+                await self._edit(text, final=True)
+                return
+            except TelegramRetryAfter as e:
+                if attempt == FINALIZE_ATTEMPTS:
+                    logger.warning("Final edit still rate limited after %d attempts, giving up", attempt)
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def _render(self, text: str, final: bool) -> None:
+        if not text.strip():
+            return
+        try:
+            await self._edit(text, final)
+        except TelegramRetryAfter as e:
+            # Не ждём во время стрима: следующий кусок просто придёт позже
+            self._next_edit = time.monotonic() + e.retry_after
+            return
+        self._next_edit = time.monotonic() + self._edit_interval
+
+    async def _edit(self, text: str, final: bool) -> None:
+        html_text = markdown_to_telegram_html(text) if final else markdown_to_telegram_html_partial(text)
+        if self._reply is None or html_text == self._shown:
+            return
+        with timed("telegram_send"):
+            try:
+                await self._reply.edit_text(html_text, parse_mode="HTML")
+            except TelegramBadRequest as e:
+                if "message is not modified" in str(e):
+                    pass
+                else:
+                    logger.debug("HTML edit rejected (%s), sending plain text", e)
+                    await self._reply.edit_text(text)
+        self._shown = html_text